@@ -0,0 +1,118 @@
+from dataclasses import dataclass, field
+from loguru import logger
+from tableutils import columnType, hasHistory, latestVersions
+from instrumentation import measure
+
+"""
+Natural key per fact table the aggregates read
+"""
+KEYS = {
+    'Product': 'PRODUCT_id',
+    'Orders': 'ORDER_TABLE_id',
+    'Order_Details': 'ORDER_DETAIL_id',
+    'Returns': 'RETURNS_id',
+}
+
+@dataclass
+class AggregateSpec:
+    table_name: str
+    """Name of the aggregate table in the Data Warehouse"""
+    columns: list
+    """Columns of the aggregate, typed by their name, MONTH_number (yyyymm) first"""
+    select: str
+    """Query of the aggregate, {Table} reads the latest version of a table and {months} filters the months"""
+    changed: str
+    """Query of the months whose rows changed, {Table} is every version and {changed_Table} the keys changed since ?"""
+    tables: list = field(default_factory=list)
+    """Tables the aggregate is computed from"""
+
+AGGREGATES = [
+    AggregateSpec(
+        table_name='Returns_By_Reason_Month',
+        columns=['MONTH_number', 'RETURN_REASON_id', 'PRODUCT_LINE_id', 'RETURNS_number', 'RETURN_QUANTITY_number'],
+        select="SELECT r.RETURN_DATE_id / 100, r.RETURN_REASON_id, p.PRODUCT_LINE_id, \
+                COUNT(*), SUM(r.RETURN_QUANTITY_number) \
+            FROM {Returns} r \
+            INNER JOIN {Order_Details} d ON d.ORDER_DETAIL_id = r.ORDER_DETAIL_id \
+            INNER JOIN {Product} p ON p.PRODUCT_id = d.PRODUCT_id \
+            WHERE r.RETURN_DATE_id / 100 {months} \
+            GROUP BY r.RETURN_DATE_id / 100, r.RETURN_REASON_id, p.PRODUCT_LINE_id",
+        changed="SELECT DISTINCT r.RETURN_DATE_id / 100 \
+            FROM {Returns} r \
+            INNER JOIN {Order_Details} d ON d.ORDER_DETAIL_id = r.ORDER_DETAIL_id \
+            INNER JOIN {Product} p ON p.PRODUCT_id = d.PRODUCT_id \
+            WHERE r.RETURNS_id IN {changed_Returns} \
+                OR d.ORDER_DETAIL_id IN {changed_Order_Details} \
+                OR p.PRODUCT_id IN {changed_Product}",
+        tables=['Returns', 'Order_Details', 'Product'],
+    ),
+    AggregateSpec(
+        # The return rate of any grouping is SUM(RETURN_QUANTITY_number) / SUM(QUANTITY_number)
+        table_name='Return_Rate_By_Product_Month',
+        columns=['MONTH_number', 'PRODUCT_id', 'QUANTITY_number', 'RETURN_QUANTITY_number'],
+        select="SELECT o.ORDER_DATE_id / 100, d.PRODUCT_id, \
+                SUM(d.QUANTITY_number), SUM(COALESCE(r.RETURN_QUANTITY_number, 0)) \
+            FROM {Order_Details} d \
+            INNER JOIN {Orders} o ON o.ORDER_TABLE_id = d.ORDER_TABLE_id \
+            LEFT JOIN ( \
+                SELECT ORDER_DETAIL_id, SUM(RETURN_QUANTITY_number) AS RETURN_QUANTITY_number \
+                FROM {Returns} returned GROUP BY ORDER_DETAIL_id \
+            ) r ON r.ORDER_DETAIL_id = d.ORDER_DETAIL_id \
+            WHERE o.ORDER_DATE_id / 100 {months} \
+            GROUP BY o.ORDER_DATE_id / 100, d.PRODUCT_id",
+        changed="SELECT DISTINCT o.ORDER_DATE_id / 100 \
+            FROM {Order_Details} d \
+            INNER JOIN {Orders} o ON o.ORDER_TABLE_id = d.ORDER_TABLE_id \
+            WHERE d.ORDER_DETAIL_id IN {changed_Order_Details} \
+                OR o.ORDER_TABLE_id IN {changed_Orders} \
+                OR d.ORDER_DETAIL_id IN (SELECT ORDER_DETAIL_id FROM {Returns} returned WHERE RETURNS_id IN {changed_Returns})",
+        tables=['Order_Details', 'Orders', 'Returns'],
+    ),
+]
+
+"""
+Query of the latest version of every row of a table, the current versions of tables with history
+"""
+def latest(table, history=False):
+    return f"({latestVersions(table, KEYS[table], '*', history)})"
+
+"""
+Gets the current timestamp of the Data Warehouse, rows inserted after it have a later Timestamp
+"""
+def currentTimestamp(target):
+    with target.cursor() as cursor:
+        cursor.execute(f"SELECT {target.now}")
+        return cursor.fetchone()[0]
+
+"""
+Builds an aggregate table from the loaded fact tables
+- Without since the aggregate is rebuilt from scratch
+- With since only the months of rows inserted after since (new versions) are recomputed
+- Rows are read through their latest version, so incremental loads aren't counted twice
+"""
+def refreshAggregate(aggregate: AggregateSpec, target, since=None):
+    with measure('aggregate', aggregate.table_name) as measurement, target.cursor() as cursor:
+        exists = target.tableExists(cursor, aggregate.table_name)
+        tables = {table: latest(table, hasHistory(cursor, table, target)) for table in aggregate.tables}
+
+        if since is None or not exists:
+            if exists:
+                cursor.execute(f"DROP TABLE {aggregate.table_name}")
+            columns = ', '.join(f'{column} {columnType(column)}' for column in aggregate.columns)
+            cursor.execute(f"CREATE TABLE {aggregate.table_name} ({columns})")
+            months = 'IS NOT NULL'
+        else:
+            changed = {f'changed_{table}': f"(SELECT {KEYS[table]} FROM {table} WHERE Timestamp >= ?)" for table in aggregate.tables}
+            query = aggregate.changed.format(**{table: table for table in aggregate.tables}, **changed)
+            cursor.execute(query, [since] * query.count('?'))
+            changed_months = [int(row[0]) for row in cursor.fetchall() if row[0] is not None]
+            if not changed_months:
+                logger.info(f"{aggregate.table_name} is up to date")
+                return
+            months = f"IN ({', '.join(str(month) for month in changed_months)})"
+            cursor.execute(f"DELETE FROM {aggregate.table_name} WHERE MONTH_number {months}")
+
+        cursor.execute(
+            f"INSERT INTO {aggregate.table_name} ({', '.join(aggregate.columns)}) "
+            + aggregate.select.format(**tables, months=months))
+        measurement.rows_out = cursor.rowcount
@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+from contextlib import nullcontext
+from dataclasses import asdict
+from datetime import datetime
+from settings import Settings
+from processing import run
+from targets import TARGETS, SQLServerTarget
+from benchmarks.generate import generate
+
+"""
+In-process stand-in for a SQL Server cursor
+- Accepts every statement and only counts what it receives
+- Measures the client side cost of create, insert and surrogate steps
+"""
+class NullCursor:
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.rowcount = 0
+        self.fast_executemany = False
+
+    def execute(self, command, *parameters):
+        self.statements += 1
+        return self
+
+    def executemany(self, command, parameters):
+        self.statements += 1
+        self.rows += len(parameters)
+
+    def fetchall(self):
+        return []
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def fetchone(self):
+        return (None,)
+
+    def close(self):
+        pass
+
+"""
+In-process stand-in for SQL Server
+- Generates the T-SQL of SQLServerTarget but sends it to a single NullCursor
+"""
+class NullTarget(SQLServerTarget):
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.null_cursor = NullCursor()
+
+    def connect(self):
+        return self
+
+    def cursor(self):
+        return nullcontext(self.null_cursor)
+
+TARGETS['null'] = NullTarget
+
+def gitVersion():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+"""
+Totals the measurements of a run (instrumentation.summarize) per stage, slowest first
+- Stages of independent tables run concurrently (runDag), so their times add up to more than the wall time
+"""
+def stageTimes(totals):
+    stages = {}
+    for total in totals:
+        stage = stages.setdefault(total.stage, {'seconds': 0.0, 'rows': 0})
+        stage['seconds'] += total.seconds
+        stage['rows'] += total.rows_out
+    return {
+        name: {'seconds': round(stage['seconds'], 4), 'rows': stage['rows']}
+        for name, stage in sorted(stages.items(), key=lambda item: item[1]['seconds'], reverse=True)
+    }
+
+"""
+Runs processing.run on the data in data_dir
+- Returns the wall time and the totals per table and stage of the run
+"""
+def benchmark(data_dir, batch_size=1000, max_workers=4, target='null', insert_partitions=1, chunk_size=None):
+    settings = Settings(server='', database='', data_dir=data_dir, log_dir=os.path.join(data_dir, 'logs'), batch_size=batch_size,
+                        max_workers=max_workers, target=target, target_path=os.path.join(data_dir, 'warehouse.sqlite'),
+                        insert_partitions=insert_partitions, pool_size=max(4, insert_partitions), chunk_size=chunk_size)
+    start = time.perf_counter()
+    totals = run(settings)
+    return time.perf_counter() - start, totals
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ETL stages on synthetic data')
+    parser.add_argument('--scale', type=float, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--output', default='benchmark.json', help='JSON file to write the results to')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--max-workers', type=int, default=4)
+    parser.add_argument('--insert-partitions', type=int, default=1, help='Connections the large (streamed) tables are inserted over')
+    parser.add_argument('--chunk-size', type=int, default=None, help='Rows per chunk the large tables are streamed in')
+    parser.add_argument('--target', choices=['null', 'sqlite'], default='null', help='null only measures the client side, sqlite loads into a local file')
+    args = parser.parse_args()
+
+    report = {
+        'version': gitVersion(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'target': args.target,
+        'insert_partitions': args.insert_partitions,
+        'chunk_size': args.chunk_size,
+        'results': [],
+    }
+
+    for scale in args.scale:
+        with tempfile.TemporaryDirectory() as data_dir:
+            generate(data_dir, scale)
+            seconds, totals = benchmark(data_dir + os.sep, args.batch_size, args.max_workers, args.target, args.insert_partitions, args.chunk_size)
+        stages = stageTimes(totals)
+        report['results'].append({
+            'scale': scale,
+            'total_seconds': round(seconds, 4),
+            'stages': stages,
+            'tables': [asdict(total) for total in totals],
+        })
+        print(f"Scale {scale}: {seconds:.2f}s, " + ', '.join(f"{name} {stage['seconds']:.2f}s" for name, stage in stages.items()))
+
+    with open(args.output, 'w') as f_out:
+        json.dump(report, f_out, indent=4)
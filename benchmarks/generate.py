@@ -0,0 +1,401 @@
+import argparse
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from extract import SQLITE_SOURCES, CSV_SOURCES
+
+"""
+Rows of the fact tables at scale factor 1, dimension tables don't scale
+"""
+FACT_ROWS = {
+    'order_header': 5_400,
+    'order_details': 45_000,
+    'returned_item': 700,
+    'SALES_TARGETData': 9_000,
+    'inventory_level': 3_900,
+    'sales_forecast': 3_900,
+}
+
+DATE_FORMAT = '%d-%b-%Y %I:%M:%S %p'
+
+"""
+Generates synthetic go_sales, go_crm and go_staff tables
+- Column names and key relations match what processing.run reads
+- Values are strings, like in the original SQLite files
+"""
+class Generator:
+    def __init__(self, scale=1, seed=0):
+        self.scale = scale
+        self.rng = np.random.default_rng(seed)
+
+    def rows(self, table):
+        return int(FACT_ROWS[table] * self.scale)
+
+    def codes(self, n, start=1):
+        return np.arange(start, start + n).astype(str)
+
+    def pick(self, values, n):
+        return self.rng.choice(np.asarray(values), n)
+
+    def integers(self, low, high, n):
+        return self.rng.integers(low, high, n).astype(str)
+
+    def money(self, low, high, n):
+        return np.round(self.rng.uniform(low, high, n), 2).astype(str)
+
+    def dates(self, n, start='2018-01-01', days=5 * 365):
+        offsets = pd.to_timedelta(self.rng.integers(0, days, n), unit='D')
+        return (pd.Timestamp(start) + offsets).strftime(DATE_FORMAT).to_numpy()
+
+    def names(self, prefix, n):
+        return np.char.add(f'{prefix} ', np.arange(1, n + 1).astype(str))
+
+    def salesTables(self, dims):
+        n_orders = self.rows('order_header')
+        n_details = self.rows('order_details')
+        n_returns = self.rows('returned_item')
+        n_targets = self.rows('SALES_TARGETData')
+        products = dims['product']['PRODUCT_NUMBER']
+        staff = dims['sales_staff']['SALES_STAFF_CODE']
+        sites = dims['retailer_site']
+
+        site_rows = self.rng.integers(0, len(sites), n_orders)
+        order_header = pd.DataFrame({
+            'ORDER_NUMBER': self.codes(n_orders, 100_000),
+            'RETAILER_NAME': self.names('Retailer', len(sites))[site_rows],
+            'RETAILER_SITE_CODE': sites['RETAILER_SITE_CODE'].to_numpy()[site_rows],
+            'RETAILER_CONTACT_CODE': self.pick(dims['retailer_contact']['RETAILER_CONTACT_CODE'], n_orders),
+            'SALES_STAFF_CODE': self.pick(staff, n_orders),
+            'SALES_BRANCH_CODE': self.pick(dims['sales_branch']['SALES_BRANCH_CODE'], n_orders),
+            'ORDER_DATE': self.dates(n_orders),
+            'ORDER_METHOD_CODE': self.integers(1, 8, n_orders),
+            'TRIAL888': 'T',
+        })
+        order_details = pd.DataFrame({
+            'ORDER_DETAIL_CODE': self.codes(n_details, 1_000_000),
+            'ORDER_NUMBER': self.pick(order_header['ORDER_NUMBER'], n_details),
+            'PRODUCT_NUMBER': self.pick(products, n_details),
+            'QUANTITY': self.integers(1, 500, n_details),
+            'UNIT_COST': self.money(1, 500, n_details),
+            'UNIT_PRICE': self.money(1, 800, n_details),
+            'UNIT_SALE_PRICE': self.money(1, 800, n_details),
+            'TRIAL888': 'T',
+        })
+        returned_item = pd.DataFrame({
+            'RETURN_CODE': self.codes(n_returns, 1_000),
+            'RETURN_DATE': self.dates(n_returns, '2018-02-01'),
+            'ORDER_DETAIL_CODE': self.pick(order_details['ORDER_DETAIL_CODE'], n_returns),
+            'RETURN_REASON_CODE': self.integers(1, 6, n_returns),
+            'RETURN_QUANTITY': self.integers(1, 50, n_returns),
+            'TRIAL888': 'T',
+        })
+        sales_target = pd.DataFrame({
+            'Id': self.codes(n_targets),
+            'SALES_STAFF_CODE': self.pick(staff, n_targets),
+            'YEAR': self.integers(2018, 2023, n_targets),
+            'MONTH': self.integers(1, 13, n_targets),
+            'RETAILER_NAME': self.pick(self.names('Retailer', len(sites)), n_targets),
+            'RETAILER_CODE': self.pick(dims['retailer']['RETAILER_CODE'], n_targets),
+            'PRODUCT_NUMBER': self.pick(products, n_targets),
+            'SALES_TARGET': self.integers(1_000, 100_000, n_targets),
+        })
+
+        country = dims['country']
+        return {
+            'country': pd.DataFrame({
+                'COUNTRY_CODE': country['COUNTRY_CODE'],
+                'COUNTRY': country['COUNTRY_EN'],
+                'LANGUAGE': self.pick(['EN', 'NL', 'DE', 'FR', 'JA'], len(country)),
+                'CURRENCY_NAME': self.pick(['euro', 'dollar', 'yen', 'krona'], len(country)),
+                'TRIAL888': 'T',
+            }),
+            'order_details': order_details,
+            'order_header': order_header,
+            'order_method': pd.DataFrame({
+                'ORDER_METHOD_CODE': self.codes(7),
+                'ORDER_METHOD_EN': ['Fax', 'Telephone', 'Mail', 'E-mail', 'Web', 'Sales visit', 'Special'],
+                'TRIAL888': 'T',
+            }),
+            'product': dims['product'],
+            'product_line': dims['product_line'],
+            'product_type': dims['product_type'],
+            'retailer_site': sites.rename(columns={'TRIAL222': 'TRIAL888'}),
+            'return_reason': pd.DataFrame({
+                'RETURN_REASON_CODE': self.codes(5),
+                'RETURN_DESCRIPTION_EN': ['Defective product', 'Incomplete product', 'Wrong product ordered',
+                                          'Wrong product shipped', 'Unsatisfactory product'],
+                'TRIAL888': 'T',
+            }),
+            'returned_item': returned_item,
+            'sales_branch': dims['sales_branch'].rename(columns={'TRIAL633': 'TRIAL888'}),
+            'sales_staff': dims['sales_staff'].rename(columns={'TRIAL633': 'TRIAL888'}),
+            'SALES_TARGETData': sales_target,
+        }
+
+    def dimensionTables(self):
+        n_countries, n_products, n_staff, n_branches = 21, 115, 102, 28
+        n_retailers, n_sites = 109, 391
+
+        sales_territory = pd.DataFrame({
+            'SALES_TERRITORY_CODE': self.codes(5),
+            'TERRITORY_NAME_EN': ['Americas', 'Asia Pacific', 'Central Europe', 'Northern Europe', 'Southern Europe'],
+            'TRIAL222': 'T',
+        })
+        country = pd.DataFrame({
+            'COUNTRY_CODE': self.codes(n_countries),
+            'COUNTRY_EN': self.names('Country', n_countries),
+            'FLAG_IMAGE': np.char.add('F', self.codes(n_countries)),
+            'SALES_TERRITORY_CODE': self.integers(1, 6, n_countries),
+            'TRIAL219': 'T',
+        })
+        product_line = pd.DataFrame({
+            'PRODUCT_LINE_CODE': self.codes(5, 991),
+            'PRODUCT_LINE_EN': ['Camping Equipment', 'Mountaineering Equipment', 'Personal Accessories',
+                                'Outdoor Protection', 'Golf Equipment'],
+            'TRIAL888': 'T',
+        })
+        product_type = pd.DataFrame({
+            'PRODUCT_TYPE_CODE': self.codes(21, 951),
+            'PRODUCT_LINE_CODE': self.pick(product_line['PRODUCT_LINE_CODE'], 21),
+            'PRODUCT_TYPE_EN': self.names('Type', 21),
+            'TRIAL888': 'T',
+        })
+        product = pd.DataFrame({
+            'PRODUCT_NUMBER': self.codes(n_products),
+            'INTRODUCTION_DATE': self.dates(n_products, '2010-01-01'),
+            'PRODUCT_TYPE_CODE': self.pick(product_type['PRODUCT_TYPE_CODE'], n_products),
+            'PRODUCTION_COST': self.money(1, 500, n_products),
+            'MARGIN': np.round(self.rng.uniform(0.1, 0.6, n_products), 2).astype(str),
+            'PRODUCT_IMAGE': np.char.add('P', self.codes(n_products)),
+            'LANGUAGE': 'EN',
+            'PRODUCT_NAME': self.names('Product', n_products),
+            'DESCRIPTION': self.names('Description of product', n_products),
+            'TRIAL888': 'T',
+        })
+        sales_branch = pd.DataFrame({
+            'SALES_BRANCH_CODE': self.codes(n_branches, 6),
+            'ADDRESS1': self.names('Branch street', n_branches),
+            'ADDRESS2': None,
+            'CITY': self.names('City', n_branches),
+            'REGION': None,
+            'POSTAL_ZONE': self.integers(1000, 9999, n_branches),
+            'COUNTRY_CODE': self.pick(country['COUNTRY_CODE'], n_branches),
+            'TRIAL633': 'T',
+        })
+        staff_codes = self.codes(n_staff, 4)
+        sales_staff = pd.DataFrame({
+            'SALES_STAFF_CODE': staff_codes,
+            'FIRST_NAME': self.names('First', n_staff),
+            'LAST_NAME': self.names('Last', n_staff),
+            'POSITION_EN': self.pick(['Level 1 Sales Representative', 'Level 2 Sales Representative',
+                                      'Branch Manager'], n_staff),
+            'WORK_PHONE': self.integers(100_000_000, 999_999_999, n_staff),
+            'EXTENSION': self.integers(100, 9999, n_staff),
+            'FAX': self.integers(100_000_000, 999_999_999, n_staff),
+            'EMAIL': np.char.add(self.names('staff', n_staff), '@example.com'),
+            'DATE_HIRED': self.dates(n_staff, '1995-01-01', 20 * 365),
+            'SALES_BRANCH_CODE': self.pick(sales_branch['SALES_BRANCH_CODE'], n_staff),
+            'MANAGER_CODE': self.pick(staff_codes, n_staff),
+            'TRIAL633': 'T',
+        })
+
+        retailer_type = pd.DataFrame({
+            'RETAILER_TYPE_CODE': self.codes(8),
+            'RETAILER_TYPE_EN': self.names('Retailer type', 8),
+            'TRIAL222': 'T',
+        })
+        retailer_segment = pd.DataFrame({
+            'SEGMENT_CODE': self.codes(12),
+            'LANGUAGE': self.pick(['EN', 'NL', 'DE', 'FR'], 12),
+            'SEGMENT_NAME': self.names('Segment', 12),
+            'SEGMENT_DESCRIPTION': self.names('Segment description', 12),
+            'TRIAL222': 'T',
+        })
+        retailer_headquarters = pd.DataFrame({
+            'RETAILER_CODEMR': self.codes(n_retailers, 1000),
+            'RETAILER_NAME': self.names('Retailer', n_retailers),
+            'ADDRESS1': self.names('Headquarters street', n_retailers),
+            'ADDRESS2': None,
+            'CITY': self.names('City', n_retailers),
+            'REGION': None,
+            'POSTAL_ZONE': self.integers(1000, 9999, n_retailers),
+            'COUNTRY_CODE': self.pick(country['COUNTRY_CODE'], n_retailers),
+            'PHONE': self.integers(100_000_000, 999_999_999, n_retailers),
+            'FAX': self.integers(100_000_000, 999_999_999, n_retailers),
+            'SEGMENT_CODE': self.pick(retailer_segment['SEGMENT_CODE'], n_retailers),
+            'TRIAL222': 'T',
+        })
+        retailer = pd.DataFrame({
+            'RETAILER_CODE': self.codes(n_retailers),
+            'RETAILER_CODEMR': retailer_headquarters['RETAILER_CODEMR'],
+            'COMPANY_NAME': self.names('Company', n_retailers),
+            'RETAILER_TYPE_CODE': self.pick(retailer_type['RETAILER_TYPE_CODE'], n_retailers),
+            'TRIAL219': 'T',
+        })
+        retailer_site = pd.DataFrame({
+            'RETAILER_SITE_CODE': self.codes(n_sites),
+            'RETAILER_CODE': self.pick(retailer['RETAILER_CODE'], n_sites),
+            'ADDRESS1': self.names('Site street', n_sites),
+            'ADDRESS2': None,
+            'CITY': self.names('City', n_sites),
+            'REGION': None,
+            'POSTAL_ZONE': self.integers(1000, 9999, n_sites),
+            'COUNTRY_CODE': self.pick(country['COUNTRY_CODE'], n_sites),
+            'ACTIVE_INDICATOR': self.integers(0, 2, n_sites),
+            'TRIAL222': 'T',
+        })
+        retailer_contact = pd.DataFrame({
+            'RETAILER_CONTACT_CODE': self.codes(n_sites),
+            'RETAILER_SITE_CODE': retailer_site['RETAILER_SITE_CODE'],
+            'FIRST_NAME': self.names('First', n_sites),
+            'LAST_NAME': self.names('Last', n_sites),
+            'JOB_POSITION_EN': self.pick(['Store Manager', 'Purchaser', 'Owner'], n_sites),
+            'EXTENSION': self.integers(100, 9999, n_sites),
+            'FAX': self.integers(100_000_000, 999_999_999, n_sites),
+            'E_MAIL': np.char.add(self.names('contact', n_sites), '@example.com'),
+            'GENDER': self.pick(['M', 'F'], n_sites),
+            'TRIAL222': 'T',
+        })
+
+        return {
+            'sales_territory': sales_territory,
+            'country': country,
+            'product_line': product_line,
+            'product_type': product_type,
+            'product': product,
+            'sales_branch': sales_branch,
+            'sales_staff': sales_staff,
+            'retailer_type': retailer_type,
+            'retailer_segment': retailer_segment,
+            'retailer_headquarters': retailer_headquarters,
+            'retailer': retailer,
+            'retailer_site': retailer_site,
+            'retailer_contact': retailer_contact,
+        }
+
+    def staffTables(self, dims):
+        staff = dims['sales_staff']['SALES_STAFF_CODE']
+        return {
+            'course': pd.DataFrame({
+                'COURSE_CODE': self.codes(9),
+                'COURSE_DESCRIPTION': self.names('Course', 9),
+                'TRIAL633': 'T',
+            }),
+            'sales_branch': dims['sales_branch'],
+            'sales_staff': dims['sales_staff'],
+            'satisfaction': pd.DataFrame({
+                'YEAR': self.integers(2018, 2023, 301),
+                'SALES_STAFF_CODE': self.pick(staff, 301),
+                'SATISFACTION_TYPE_CODE': self.integers(1, 6, 301),
+                'TRIAL633': 'T',
+            }),
+            'satisfaction_type': pd.DataFrame({
+                'SATISFACTION_TYPE_CODE': self.codes(5),
+                'SATISFACTION_TYPE_DESCRIPTION': self.names('Satisfaction', 5),
+                'TRIAL633': 'T',
+            }),
+            'training': pd.DataFrame({
+                'YEAR': self.integers(2018, 2023, 402),
+                'SALES_STAFF_CODE': self.pick(staff, 402),
+                'COURSE_CODE': self.integers(1, 10, 402),
+                'TRIAL633': 'T',
+            }),
+        }
+
+    def crmTables(self, dims):
+        n_groups = 6
+        return {
+            'age_group': pd.DataFrame({
+                'AGE_GROUP_CODE': self.codes(n_groups),
+                'UPPER_AGE': self.integers(20, 80, n_groups),
+                'LOWER_AGE': self.integers(0, 20, n_groups),
+                'TRIAL219': 'T',
+            }),
+            'country': dims['country'],
+            'retailer': dims['retailer'],
+            'retailer_contact': dims['retailer_contact'],
+            'retailer_headquarters': dims['retailer_headquarters'],
+            'retailer_segment': dims['retailer_segment'],
+            'retailer_site': dims['retailer_site'],
+            'retailer_type': dims['retailer_type'],
+            'sales_demographic': pd.DataFrame({
+                'DEMOGRAPHIC_CODE': self.codes(2484),
+                'RETAILER_CODEMR': self.pick(dims['retailer']['RETAILER_CODEMR'], 2484),
+                'AGE_GROUP_CODE': self.integers(1, n_groups + 1, 2484),
+                'SALES_PERCENT': self.integers(1, 100, 2484),
+                'TRIAL222': 'T',
+            }),
+            'sales_territory': dims['sales_territory'],
+        }
+
+    def csvTables(self, dims):
+        products = dims['product']['PRODUCT_NUMBER']
+        n_inventory = self.rows('inventory_level')
+        n_forecast = self.rows('sales_forecast')
+        return {
+            'inventory_level': pd.DataFrame({
+                'INVENTORY_YEAR': self.integers(2018, 2023, n_inventory),
+                'INVENTORY_MONTH': self.integers(1, 13, n_inventory),
+                'PRODUCT_NUMBER': self.pick(products, n_inventory),
+                'INVENTORY_COUNT': self.integers(0, 5000, n_inventory),
+            }),
+            'sales_forecast': pd.DataFrame({
+                'PRODUCT_NUMBER': self.pick(products, n_forecast),
+                'YEAR': self.integers(2018, 2023, n_forecast),
+                'MONTH': self.integers(1, 13, n_forecast),
+                'EXPECTED_VOLUME': self.integers(0, 5000, n_forecast),
+            }),
+        }
+
+"""
+Writes tables into a SQLite file, every column is VARCHAR(255) like the original files
+"""
+def writeSqlite(path, tables):
+    if os.path.exists(path):
+        os.remove(path)
+    con = sqlite3.connect(path)
+    try:
+        for name, dataframe in tables.items():
+            columns = ', '.join(f'"{column}" VARCHAR(255)' for column in dataframe.columns)
+            con.execute(f'CREATE TABLE "{name}" ({columns})')
+            dataframe.to_sql(name, con, if_exists='append', index=False)
+        con.commit()
+    finally:
+        con.close()
+
+"""
+Writes a CSV export
+- The inventory export has a trailing comma on every data row, like the original file
+"""
+def writeCSV(path, dataframe, trailing_comma=False):
+    with open(path, 'w', newline='') as f_out:
+        f_out.write(','.join(dataframe.columns) + '\n')
+        suffix = ',' if trailing_comma else ''
+        for row in dataframe.itertuples(index=False):
+            f_out.write(','.join(row) + suffix + '\n')
+
+"""
+Generates all source files of processing.run into data_dir at a scale factor
+"""
+def generate(data_dir, scale=1, seed=0):
+    os.makedirs(data_dir, exist_ok=True)
+    generator = Generator(scale, seed)
+    dims = generator.dimensionTables()
+
+    writeSqlite(os.path.join(data_dir, SQLITE_SOURCES['sales']), generator.salesTables(dims))
+    writeSqlite(os.path.join(data_dir, SQLITE_SOURCES['staff']), generator.staffTables(dims))
+    writeSqlite(os.path.join(data_dir, SQLITE_SOURCES['crm']), generator.crmTables(dims))
+
+    csv_tables = generator.csvTables(dims)
+    writeCSV(os.path.join(data_dir, CSV_SOURCES['inventory_level']), csv_tables['inventory_level'], trailing_comma=True)
+    writeCSV(os.path.join(data_dir, CSV_SOURCES['sales_forecast']), csv_tables['sales_forecast'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic source data for processing.run')
+    parser.add_argument('data_dir')
+    parser.add_argument('--scale', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.data_dir, args.scale, args.seed)
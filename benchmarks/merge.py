@@ -0,0 +1,70 @@
+import argparse
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from tableutils import mergeTables
+
+"""
+mergeTables as it was before the vectorized rewrite, kept as benchmark baseline
+"""
+def legacyMergeTables(df1, df2, index_col):
+    df1 = df1.set_index(index_col)
+    df2 = df2.set_index(index_col)
+
+    common_columns = df1.columns.intersection(df2.columns)
+    exclusive_df1 = df1.columns.difference(df2.columns)
+    exclusive_df2 = df2.columns.difference(df1.columns)
+
+    df1_combined = pd.concat([df1, df2[exclusive_df2]], axis=1, sort=False)
+    df2_combined = pd.concat([df2, df1[exclusive_df1]], axis=1, sort=False)
+
+    for col in common_columns:
+        series1, series2 = df1_combined[col].align(df2_combined[col])
+        conflict_mask = (~series1.isnull() & ~series2.isnull() & (series1 != series2))
+        if conflict_mask.any():
+            raise ValueError(f"Merge failed due to conflict in column '{col}'")
+        df1_combined[col] = series1.combine_first(series2)
+
+    return df1_combined
+
+"""
+Generates two overlapping sources with common, exclusive and partially missing columns
+"""
+def generateSources(rows, common_columns=6, overlap=0.5, seed=0):
+    rng = np.random.default_rng(seed)
+    keys = np.arange(rows * (2 - overlap), dtype=np.int64)
+    values = {f'COMMON_{i}': rng.integers(0, 1000, len(keys)).astype(str) for i in range(common_columns)}
+    full = pd.DataFrame({'CODE': keys, **values, 'ONLY1': rng.random(len(keys)), 'ONLY2': rng.random(len(keys))})
+
+    df1 = full.iloc[:rows].drop(columns='ONLY2')
+    df2 = full.iloc[len(keys) - rows:].drop(columns='ONLY1')
+
+    # Missing values that have to be filled from the other source
+    df1 = df1.mask(pd.DataFrame(rng.random(df1.shape) < 0.1, index=df1.index, columns=df1.columns).assign(CODE=False))
+    return df1, df2
+
+"""
+Measures wall time and peak traced memory of a merge
+"""
+def measure(merge, df1, df2):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = merge(df1, df2, 'CODE')
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark mergeTables against the previous implementation')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'legacy s':>10} {'legacy MB':>10} {'new s':>10} {'new MB':>10}")
+    for rows in args.rows:
+        df1, df2 = generateSources(rows)
+        legacy, legacy_time, legacy_peak = measure(legacyMergeTables, df1, df2)
+        result, new_time, new_peak = measure(mergeTables, df1, df2)
+        pd.testing.assert_frame_equal(result, legacy)
+        print(f"{rows:>10} {legacy_time:>10.2f} {legacy_peak / 2**20:>10.1f} {new_time:>10.2f} {new_peak / 2**20:>10.1f}")
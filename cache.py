@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+import pyarrow as pa
+from loguru import logger
+from settings import Settings
+from dtypes import decimalTypes
+
+"""
+Bump when the extraction or the cached file format changes, so old entries are never read
+"""
+CACHE_VERSION = 2
+
+FINGERPRINTS = 'fingerprints.json'
+DIGESTS = 'digests.json'
+
+"""
+Content addressed cache of extracted source tables
+- Every source file is fingerprinted by size, mtime and content hash
+- An entry is keyed by the content hash of its file and the query that extracted it
+- Entries are Arrow IPC files that are memory-mapped back on a hit
+- The least recently used entries are evicted once the cache exceeds max_bytes
+- Small digests computed from a file (catalog.contentHash) are kept with the content hash of the file they were computed from
+"""
+class ExtractCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # Content hashes of files whose size and mtime didn't change aren't computed again
+        try:
+            with open(os.path.join(directory, FINGERPRINTS)) as f_in:
+                self.fingerprints = json.load(f_in)
+        except (OSError, ValueError):
+            self.fingerprints = {}
+        try:
+            with open(os.path.join(directory, DIGESTS)) as f_in:
+                self.digests = json.load(f_in)
+        except (OSError, ValueError):
+            self.digests = {}
+
+    """
+    Gets the content hash of a file, only hashing it when its size or mtime changed
+    """
+    def fileHash(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            fingerprint = self.fingerprints.get(path)
+            if fingerprint and fingerprint['size'] == stat.st_size and fingerprint['mtime'] == stat.st_mtime_ns:
+                return fingerprint['hash']
+
+            digest = hashlib.blake2b()
+            with open(path, 'rb') as f_in:
+                for block in iter(lambda: f_in.read(2**20), b''):
+                    digest.update(block)
+
+            self.fingerprints[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': digest.hexdigest()}
+            with open(os.path.join(self.directory, FINGERPRINTS), 'w') as f_out:
+                json.dump(self.fingerprints, f_out, indent=4)
+            return digest.hexdigest()
+
+    """
+    Gets a digest named name computed from a file, None when it wasn't stored or the file changed since
+    """
+    def getDigest(self, path, name):
+        file_hash = self.fileHash(path)
+        with self.lock:
+            digest = self.digests.get(os.path.abspath(path), {}).get(name)
+        return digest['hash'] if digest is not None and digest['file'] == file_hash else None
+
+    """
+    Stores a digest computed from the current content of a file, replacing the one computed from an older content
+    """
+    def putDigest(self, path, name, digest):
+        file_hash = self.fileHash(path)
+        with self.lock:
+            self.digests.setdefault(os.path.abspath(path), {})[name] = {'file': file_hash, 'hash': digest}
+            with open(os.path.join(self.directory, DIGESTS), 'w') as f_out:
+                json.dump(self.digests, f_out, indent=4)
+
+    def key(self, path, query):
+        return hashlib.blake2b(f'{CACHE_VERSION}\0{self.fileHash(path)}\0{query}'.encode(), digest_size=20).hexdigest()
+
+    def entryPath(self, key):
+        return os.path.join(self.directory, f'{key}.arrow')
+
+    """
+    Memory-maps a cached table, None when it isn't cached
+    """
+    def get(self, key):
+        path = self.entryPath(key)
+        try:
+            # The map stays open as long as the columns reference it
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        except (OSError, pa.ArrowInvalid):
+            return None
+        # The modification time orders the entries for eviction
+        os.utime(path)
+        return table.to_pandas(types_mapper=decimalTypes)
+
+    """
+    Stores a table, tables that Arrow can't represent (mixed types) aren't cached
+    """
+    def put(self, key, dataframe):
+        try:
+            table = pa.Table.from_pandas(dataframe)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            logger.warning(f"Not caching {key}: {e}")
+            return
+
+        # Write next to the entry and rename, so readers never see a partial file
+        path = self.entryPath(key)
+        partial = f'{path}.{threading.get_ident()}.tmp'
+        with pa.OSFile(partial, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(partial, path)
+        self.evict()
+
+    """
+    Removes the least recently used entries until the cache fits in max_bytes
+    """
+    def evict(self):
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.arrow'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+"""
+Gets the extraction cache configured in settings, None when caching is disabled
+"""
+def getCache(settings: Settings):
+    if settings.cache_dir is None:
+        return None
+    return ExtractCache(settings.cache_dir, settings.cache_size)
@@ -0,0 +1,152 @@
+import hashlib
+import os
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+from loguru import logger
+from settings import Settings
+from schema import getSchema
+from tableutils import getSqlite, rowHashes, mergeTables
+from extract import SQLITE_SOURCES, listTables
+from cache import getCache
+from instrumentation import measure, frameBytes
+
+"""
+Rows read per chunk while hashing the content of a table
+"""
+HASH_CHUNK_SIZE = 50000
+
+@dataclass
+class SourceTable:
+    name: str
+    """Registry name (<source>.<table>)"""
+    filename: str
+    """SQLite database of the table"""
+    table: str
+    """Table name inside the database"""
+    columns: list = field(default_factory=list)
+    """Columns in the order of the table"""
+    rows: int = 0
+    """Number of rows"""
+
+@dataclass
+class Duplicate:
+    table: str
+    """Table name shared by the copies"""
+    copies: list
+    """Registry names of the copies, in the order of SQLITE_SOURCES"""
+    identical: bool
+    """Whether every copy has the same rows, identical copies are only read once"""
+    key: str = None
+    """Column differing copies are merged on, the first column of the first copy"""
+
+"""
+Lists the tables of every SQLite source with their columns and row count
+"""
+def listSources(settings: Settings):
+    sources = []
+    for source, filename in SQLITE_SOURCES.items():
+        tables = listTables(settings, filename)
+        con = getSqlite(settings, filename)
+        try:
+            for table in tables:
+                columns = [row[1] for row in con.execute(f'PRAGMA table_info("{table}")')]
+                rows = con.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                sources.append(SourceTable(f'{source}.{table}', filename, table, columns, rows))
+        finally:
+            con.close()
+    return sources
+
+"""
+Gets the columns two copies are compared on
+- Columns renames.json doesn't know are dropped while transforming, those that only some copies have (TRIAL columns) are ignored
+"""
+def comparedColumns(copies):
+    known = getSchema().renames
+    shared = set.intersection(*(set(copy.columns) for copy in copies))
+    return [sorted(column for column in copy.columns if column in shared or column in known) for copy in copies]
+
+"""
+Hashes the rows of a table over some of its columns, chunk by chunk
+- Rows are hashed as strings (rowHashes) and summed, so the hash doesn't depend on the row order or the column types
+- With an extraction cache the hash is stored with the fingerprint of the database, and only computed again once it changes
+"""
+def contentHash(settings: Settings, source: SourceTable, columns, chunk_size=HASH_CHUNK_SIZE, cache=None):
+    path = os.path.join(settings.data_dir, source.filename)
+    name = f"{source.table}\0{','.join(columns)}"
+    if cache is not None:
+        digest = cache.getDigest(path, name)
+        if digest is not None:
+            return digest
+
+    total = 0
+    selected = ', '.join(f'"{column}"' for column in columns)
+    con = getSqlite(settings, source.filename)
+    try:
+        for chunk in pd.read_sql_query(f'SELECT {selected} FROM "{source.table}"', con, chunksize=chunk_size):
+            total = (total + int(rowHashes(chunk).to_numpy().view(np.uint64).sum(dtype=np.uint64))) % 2**64
+    finally:
+        con.close()
+    digest = hashlib.blake2b(f"{','.join(columns)}\0{source.rows}\0{total}".encode(), digest_size=20).hexdigest()
+    if cache is not None:
+        cache.putDigest(path, name, digest)
+    return digest
+
+"""
+Finds the tables that exist in more than one SQLite source
+- Copies with other columns or row counts differ without reading them
+- Only copies that could be identical have their content hashed, unchanged databases reuse the hash stored in the extraction cache
+"""
+def findDuplicates(settings: Settings, sources=None):
+    sources = sources if sources is not None else listSources(settings)
+    cache = getCache(settings)
+    groups = {}
+    for source in sources:
+        groups.setdefault(source.table.lower(), []).append(source)
+
+    duplicates = []
+    for copies in groups.values():
+        if len(copies) < 2:
+            continue
+        with measure('catalog', copies[0].table, sum(copy.rows for copy in copies)):
+            columns = comparedColumns(copies)
+            identical = all(compared == columns[0] for compared in columns) and len({copy.rows for copy in copies}) == 1
+            if identical:
+                hashes = {contentHash(settings, copy, compared, cache=cache) for copy, compared in zip(copies, columns)}
+                identical = len(hashes) == 1
+        duplicate = Duplicate(copies[0].table, [copy.name for copy in copies], identical, copies[0].columns[0])
+        logger.info(f"{duplicate.table} exists in {', '.join(duplicate.copies)}, {'identical' if identical else 'differing'} copies")
+        duplicates.append(duplicate)
+    return duplicates
+
+"""
+Merges the differing copies of every duplicate table on their key, every copy's name then refers to the merged table
+- Conflicting values raise a MergeConflictError (mergeTables), missing values are filled from the other copies
+- Copies in skip are reconciled by hand
+"""
+def mergeCopies(sources, duplicates, skip=()):
+    for duplicate in duplicates:
+        copies = [copy for copy in duplicate.copies if copy in sources]
+        if duplicate.identical or len(copies) < 2 or set(skip) & set(copies):
+            continue
+        with measure('merge', duplicate.table, sum(len(sources[copy]) for copy in copies)) as measurement:
+            merged = sources[copies[0]]
+            for copy in copies[1:]:
+                merged = mergeTables(merged, sources[copy], duplicate.key).reset_index()
+            for copy in copies:
+                sources[copy] = merged
+            measurement.rows_out = len(merged)
+            measurement.bytes = frameBytes(merged)
+    return sources
+
+"""
+Gets the tables to extract when only some are needed, differing copies are always merged with every other copy
+"""
+def requiredCopies(duplicates, only):
+    return set(only) | {copy for duplicate in duplicates if not duplicate.identical and set(only) & set(duplicate.copies) for copy in duplicate.copies}
+
+"""
+Gets the copies that are read through another copy, every identical copy is read through the first one
+"""
+def sourceAliases(duplicates):
+    return {copy: duplicate.copies[0] for duplicate in duplicates if duplicate.identical for copy in duplicate.copies[1:]}
@@ -0,0 +1,179 @@
+import json
+import os
+import threading
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from settings import Settings
+from dtypes import decimalTypes
+
+MANIFEST = 'manifest.json'
+
+"""
+Settings a run can only be resumed with when they didn't change
+"""
+RESUME_SETTINGS = ['server', 'database', 'data_dir', 'target', 'target_path', 'incremental', 'chunk_size', 'pushdown', 'profile_types']
+
+"""
+Records the progress of a run so a failed run can be resumed
+- Every finished task of the DAG (transform, validate, load, surrogates, aggregate) is marked done
+- Loads also record how many chunks are inserted, every chunk is committed on its own
+- Staged tables are persisted as Parquet files next to the manifest, resumed runs read them instead of extracting and transforming again
+- The manifest is rewritten atomically after every change
+"""
+class RunManifest:
+    def __init__(self, directory, state):
+        self.directory = directory
+        self.state = state
+        self.lock = threading.Lock()
+
+    """
+    Starts a new run, removing the progress and staged tables of the previous one
+    """
+    @classmethod
+    def start(cls, settings: Settings):
+        os.makedirs(settings.checkpoint_dir, exist_ok=True)
+        for entry in os.scandir(settings.checkpoint_dir):
+            if entry.name == MANIFEST or entry.name.endswith('.parquet'):
+                os.remove(entry.path)
+        manifest = cls(settings.checkpoint_dir, {'settings': fingerprint(settings), 'tasks': {}, 'finished': False})
+        manifest.write()
+        return manifest
+
+    """
+    Loads the manifest of an interrupted run
+    - Raises ValueError when there's nothing to resume or the run used other settings
+    """
+    @classmethod
+    def resume(cls, settings: Settings):
+        try:
+            with open(os.path.join(settings.checkpoint_dir, MANIFEST)) as f_in:
+                state = json.load(f_in)
+        except (OSError, ValueError):
+            raise ValueError(f"No run to resume in {settings.checkpoint_dir}")
+
+        if state.get('finished'):
+            raise ValueError(f"The run in {settings.checkpoint_dir} finished, there's nothing to resume")
+
+        changed = [key for key, value in fingerprint(settings).items() if state['settings'].get(key) != value]
+        if changed:
+            raise ValueError(f"Can't resume a run with other settings ({', '.join(changed)}), start a new run")
+
+        done = [name for name, task in state['tasks'].items() if task.get('done')]
+        logger.info(f"Resuming run, {len(done)} tasks are already done")
+        return cls(settings.checkpoint_dir, state)
+
+    def write(self):
+        path = os.path.join(self.directory, MANIFEST)
+        with open(f'{path}.tmp', 'w') as f_out:
+            json.dump(self.state, f_out, indent=4)
+        os.replace(f'{path}.tmp', path)
+
+    def update(self, **values):
+        with self.lock:
+            self.state.update(values)
+            self.write()
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.state.get(key, default)
+
+    def task(self, name):
+        with self.lock:
+            return dict(self.state['tasks'].get(name, {}))
+
+    def isDone(self, name):
+        return self.task(name).get('done', False)
+
+    """
+    Records the progress of a task (done, chunks)
+    """
+    def setTask(self, name, **progress):
+        with self.lock:
+            self.state['tasks'].setdefault(name, {}).update(progress)
+            self.write()
+
+    def stagedPath(self, table):
+        return os.path.join(self.directory, f'{table}.parquet')
+
+    """
+    Persists a staged table, returns whether it could be stored (Arrow can't store mixed types)
+    """
+    def saveStaged(self, table, dataframe):
+        try:
+            dataframe.to_parquet(f'{self.stagedPath(table)}.tmp', engine='pyarrow', index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            logger.warning(f"Not checkpointing {table}: {e}")
+            return False
+        os.replace(f'{self.stagedPath(table)}.tmp', self.stagedPath(table))
+        return True
+
+    def loadStaged(self, table):
+        return pq.read_table(self.stagedPath(table)).to_pandas(types_mapper=decimalTypes)
+
+    """
+    Marks the run as finished and removes the staged tables
+    """
+    def finish(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.parquet'):
+                os.remove(entry.path)
+        self.update(finished=True)
+
+"""
+Gets the settings that decide what a run loads, as JSON values
+"""
+def fingerprint(settings: Settings):
+    return {key: None if getattr(settings, key) is None else str(getattr(settings, key)) for key in RESUME_SETTINGS}
+
+"""
+Gets the manifest of the run, None when checkpoints are disabled
+- With Settings.resume the manifest of the interrupted run is continued
+"""
+def getManifest(settings: Settings):
+    if settings.checkpoint_dir is None:
+        if settings.resume:
+            raise ValueError("Resuming needs Settings.checkpoint_dir")
+        return None
+    if settings.resume:
+        return RunManifest.resume(settings)
+    return RunManifest.start(settings)
+
+"""
+Wraps the tasks of a DAG so finished tasks are recorded and skipped when resuming
+- Transforms that staged a whole table persist it, a skipped transform returns the persisted table
+"""
+def checkpointTasks(tasks, manifest: RunManifest):
+    def checkpointed(name, fn):
+        def run(results):
+            if manifest.isDone(name):
+                logger.info(f"Skipping {name}, done before the run was resumed")
+                if name.startswith('transform:'):
+                    return [manifest.loadStaged(name.split(':', 1)[1])]
+                return None
+
+            result = fn(results)
+            # Streamed transforms only return a generator, they're done once they're loaded
+            if name.startswith('transform:'):
+                if isinstance(result, list) and manifest.saveStaged(name.split(':', 1)[1], result[0]):
+                    manifest.setTask(name, done=True)
+            else:
+                manifest.setTask(name, done=True)
+            return result
+        return run
+
+    return {name: (checkpointed(name, fn), dependencies) for name, (fn, dependencies) in tasks.items()}
+
+"""
+Stores a timestamp of the Data Warehouse (datetime or text) as JSON
+"""
+def timestampValue(timestamp):
+    if isinstance(timestamp, datetime):
+        return {'datetime': timestamp.isoformat()}
+    return {'text': timestamp}
+
+def timestampFromValue(value):
+    if 'datetime' in value:
+        return datetime.fromisoformat(value['datetime'])
+    return value['text']
@@ -0,0 +1,178 @@
+import os
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+from loguru import logger
+from schema import getSchema, typeSuffix, PANDAS_DTYPES
+from dtypes import MONEY_DTYPE
+
+TRAILING = 'TRAILING'
+
+"""
+Columns of the CSV exports in file order
+- Every data row of the inventory export ends with a delimiter, its empty last field is read as TRAILING and dropped
+"""
+CSV_COLUMNS = {
+    'GO_SALES_INVENTORY_LEVELSData.csv': ['INVENTORY_YEAR', 'INVENTORY_MONTH', 'PRODUCT_NUMBER', 'INVENTORY_COUNT', TRAILING],
+    'GO_SALES_PRODUCT_FORECASTData.csv': ['PRODUCT_NUMBER', 'YEAR', 'MONTH', 'EXPECTED_VOLUME'],
+}
+
+"""
+Arrow type per pandas dtype of schema.PANDAS_DTYPES
+- Dates are read as strings and parsed by castTypes
+"""
+ARROW_TYPES = {
+    'Int32': pa.int32(),
+    'float64': pa.float64(),
+    'boolean': pa.bool_(),
+    'decimal': MONEY_DTYPE.pyarrow_dtype,
+    'datetime64[ns]': pa.string(),
+    'category': pa.string(),
+    'object': pa.string(),
+}
+
+"""
+Nullable pandas dtypes of the Arrow types, the other types use the pandas defaults
+- Decimals stay fixed-point instead of becoming decimal.Decimal objects
+"""
+PANDAS_TYPES = {
+    pa.int32(): pd.Int32Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+    MONEY_DTYPE.pyarrow_dtype: MONEY_DTYPE,
+}
+
+"""
+Gets the Arrow type of a raw CSV column from the type of its renamed column
+- Columns that aren't in renames.json are read as strings
+"""
+def arrowType(column):
+    renamed = getSchema().renames.get(column)
+    if renamed is None:
+        return pa.string()
+    return ARROW_TYPES[PANDAS_DTYPES[typeSuffix(renamed)]]
+
+"""
+Collects the malformed rows of a CSV file
+- Rows with the wrong number of fields are skipped by the parser
+- Rows with values that don't fit the column type are removed after parsing
+- write() stores them in <directory>/<filename> for inspection
+"""
+class Quarantine:
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows = []
+        self.lock = threading.Lock()
+
+    # invalid_row_handler of the Arrow CSV parser
+    def __call__(self, row):
+        with self.lock:
+            self.rows.append(f"line {row.number}: expected {row.expected_columns} fields, got {row.actual_columns}: {row.text}")
+        return 'skip'
+
+    def add(self, reason, values):
+        with self.lock:
+            self.rows.extend(f"{reason}: {','.join('' if value is None else str(value) for value in row)}" for row in values)
+
+    def write(self, directory):
+        if not self.rows:
+            return
+        logger.warning(f"Quarantined {len(self.rows)} malformed rows of {self.filename}")
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, self.filename), 'w') as f_out:
+                f_out.write('\n'.join(self.rows) + '\n')
+
+"""
+Casts the string columns of a parsed CSV batch to their types
+- Rows with values that can't be cast are quarantined and removed
+"""
+def castBatch(table, types, quarantine):
+    invalid = pa.array([False] * table.num_rows)
+    for column, column_type in types.items():
+        if column_type == pa.string():
+            continue
+        try:
+            pc.cast(table[column], column_type)
+        except pa.ArrowInvalid:
+            # Slow path, only taken for batches with malformed values
+            invalid = pc.or_(invalid, pa.array([not castable(value, column_type) for value in table[column].to_pylist()]))
+
+    if pc.any(invalid).as_py():
+        quarantine.add('invalid value', zip(*table.filter(invalid).to_pydict().values()))
+        table = table.filter(pc.invert(invalid))
+
+    return pa.table({
+        column: pc.cast(table[column], column_type) for column, column_type in types.items()
+    })
+
+def castable(value, column_type):
+    try:
+        pa.array([value], pa.string()).cast(column_type)
+        return True
+    except pa.ArrowInvalid:
+        return False
+
+"""
+Converts a typed Arrow table to pandas
+- Integers and booleans become nullable pandas dtypes, decimals fixed-point Arrow dtypes, strings of category columns become categories
+"""
+def toPandas(table):
+    dataframe = table.to_pandas(types_mapper=PANDAS_TYPES.get)
+    for column in dataframe.columns:
+        renamed = getSchema().renames.get(column)
+        if renamed is not None and PANDAS_DTYPES[typeSuffix(renamed)] == 'category':
+            dataframe[column] = dataframe[column].astype('category')
+    return dataframe
+
+"""
+Reads a CSV export with the Arrow parser
+- Known exports (CSV_COLUMNS) are read with their explicit columns, their header must match them
+- Other files are read with the columns of their header
+- Columns are typed from renames.json on the first pass, usecols limits the columns that are read
+- Malformed rows are quarantined to quarantine_dir
+- With chunksize an iterator of dataframes of chunksize rows is returned
+"""
+def readCSV(path, chunksize=None, usecols=None, quarantine_dir=None):
+    filename = os.path.basename(path)
+    with open(path) as f_in:
+        header = next(line for line in f_in if line.strip()).strip().split(',')
+
+    columns = CSV_COLUMNS.get(filename, header)
+    if [column for column in columns if column != TRAILING] != header:
+        raise ValueError(f"Header of {filename} is {header}, expected {columns}")
+
+    selected = [column for column in columns if column != TRAILING and (usecols is None or column in usecols)]
+    types = {column: arrowType(column) for column in selected}
+    quarantine = Quarantine(filename)
+
+    # Parse everything as strings (empty fields are missing), casting happens per batch so bad values can be quarantined
+    read_options = pv.ReadOptions(column_names=columns, skip_rows=1)
+    parse_options = pv.ParseOptions(invalid_row_handler=quarantine)
+    convert_options = pv.ConvertOptions(column_types={column: pa.string() for column in columns}, include_columns=selected, strings_can_be_null=True)
+
+    if chunksize is None:
+        table = pv.read_csv(path, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+        dataframe = toPandas(castBatch(table, types, quarantine))
+        quarantine.write(quarantine_dir)
+        return dataframe
+
+    return readCSVChunks(path, chunksize, types, quarantine, quarantine_dir, read_options, parse_options, convert_options)
+
+def readCSVChunks(path, chunksize, types, quarantine, quarantine_dir, read_options, parse_options, convert_options):
+    reader = pv.open_csv(path, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+    pending = []
+    rows = 0
+    for batch in reader:
+        pending.append(castBatch(pa.Table.from_batches([batch]), types, quarantine))
+        rows += pending[-1].num_rows
+        while rows >= chunksize:
+            table = pa.concat_tables(pending)
+            yield toPandas(table.slice(0, chunksize))
+            pending = [table.slice(chunksize)]
+            rows -= chunksize
+
+    if rows > 0:
+        yield toPandas(pa.concat_tables(pending))
+    quarantine.write(quarantine_dir)
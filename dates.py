@@ -0,0 +1,80 @@
+import threading
+import pandas as pd
+
+"""
+Date columns that get a yyyymmdd key column linking them to the Date dimension
+"""
+DATE_KEYS = {
+    'ORDER_DATE_date': 'ORDER_DATE_id',
+    'RETURN_DATE_date': 'RETURN_DATE_id',
+}
+
+"""
+Gets the yyyymmdd integer keys of a datetime series, missing dates get missing keys
+"""
+def dateKeys(series):
+    return (series.dt.year * 10000 + series.dt.month * 100 + series.dt.day).astype('Int32')
+
+"""
+Adds the key column of every date column of a typed dataframe that has one (DATE_KEYS)
+"""
+def addDateKeys(dataframe):
+    keys = {key: dateKeys(dataframe[column]) for column, key in DATE_KEYS.items() if column in dataframe.columns}
+    return dataframe.assign(**keys) if keys else dataframe
+
+"""
+Keeps track of the first and last date of every loaded date column
+- observe() passes the chunks of a table through, loaders run concurrently
+"""
+class DateRange:
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.lock = threading.Lock()
+
+    def update(self, dataframe):
+        for column in dataframe.columns:
+            if not pd.api.types.is_datetime64_any_dtype(dataframe[column]):
+                continue
+            start, end = dataframe[column].min(), dataframe[column].max()
+            if pd.isna(start):
+                continue
+            with self.lock:
+                self.start = start if self.start is None else min(self.start, start)
+                self.end = end if self.end is None else max(self.end, end)
+
+    """
+    Gets the range as JSON values, None before any date was seen
+    """
+    def save(self):
+        with self.lock:
+            return None if self.start is None else [self.start.isoformat(), self.end.isoformat()]
+
+    @classmethod
+    def restore(cls, value):
+        observed = cls()
+        if value is not None:
+            observed.start, observed.end = (pd.Timestamp(date) for date in value)
+        return observed
+
+    def observe(self, chunks):
+        for chunk in chunks:
+            self.update(chunk)
+            yield chunk
+
+"""
+Generates the Date dimension with one row per day from start to end
+"""
+def dateDimension(start, end):
+    days = pd.Series(pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq='D'))
+    return pd.DataFrame({
+        'DATE_id': dateKeys(days),
+        'DATE_date': days,
+        'YEAR_number': days.dt.year.astype('Int32'),
+        'QUARTER_number': days.dt.quarter.astype('Int32'),
+        'MONTH_number': days.dt.month.astype('Int32'),
+        'MONTH_name': days.dt.month_name().astype('category'),
+        'DAY_number': days.dt.day.astype('Int32'),
+        'WEEKDAY_number': (days.dt.dayofweek + 1).astype('Int32'),
+        'WEEKDAY_name': days.dt.day_name().astype('category'),
+    })
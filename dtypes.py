@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from decimal import Decimal, InvalidOperation
+from loguru import logger
+from schema import getSchema
+
+"""
+Columns with at most this share of distinct values are stored as category
+"""
+CATEGORY_RATIO = 0.5
+
+"""
+Format of the dates in the sources ('23-Jul-1998 12:00:00 AM')
+"""
+DATE_FORMAT = '%d-%b-%Y %I:%M:%S %p'
+
+"""
+Scale of DECIMAL(19,4), the SQL type of money columns
+"""
+MONEY_SCALE = Decimal('0.0001')
+
+
+"""
+pandas dtype of money columns, exact fixed-point DECIMAL(19,4) values stored by Arrow instead of decimal.Decimal objects
+"""
+MONEY_DTYPE = pd.ArrowDtype(pa.decimal128(19, 4))
+
+"""
+Smallest absolute value beyond the precision of DECIMAL(19,4)
+"""
+MONEY_LIMIT = 10 ** (MONEY_DTYPE.pyarrow_dtype.precision - MONEY_DTYPE.pyarrow_dtype.scale)
+
+BOOL_VALUES = {
+    '1': True, '0': False,
+    'true': True, 'false': False,
+    't': True, 'f': False,
+    'y': True, 'n': False,
+}
+
+"""
+Raised when a column can't be cast to its dtype without losing values
+"""
+class LossyCastError(ValueError):
+    pass
+
+def _missing(series):
+    # Empty strings count as missing values
+    return series.isna() | (series.astype(str).str.strip() == '')
+
+def _lossy(column, series, invalid, reason):
+    examples = series[invalid].astype(str).unique()[:5].tolist()
+    raise LossyCastError(f"{column}: {invalid.sum()} values {reason}, e.g. {examples}")
+
+def castInteger(column, series, dtype='Int32'):
+    missing = _missing(series)
+    numeric = pd.to_numeric(series.where(~missing), errors='coerce')
+    if (numeric.isna() & ~missing).any():
+        _lossy(column, series, numeric.isna() & ~missing, 'are not numeric')
+    if (numeric.notna() & (numeric % 1 != 0)).any():
+        _lossy(column, series, numeric.notna() & (numeric % 1 != 0), 'are not integers')
+    info = np.iinfo(dtype.lower())
+    if ((numeric < info.min) | (numeric > info.max)).any():
+        _lossy(column, series, (numeric < info.min) | (numeric > info.max), f'overflow {dtype}')
+    return numeric.astype(dtype)
+
+def castFloat(column, series):
+    missing = _missing(series)
+    numeric = pd.to_numeric(series.where(~missing), errors='coerce')
+    if (numeric.isna() & ~missing).any():
+        _lossy(column, series, numeric.isna() & ~missing, 'are not numeric')
+    return numeric.astype('float64')
+
+def castBoolean(column, series):
+    missing = _missing(series)
+    values = series.where(~missing).astype(str).str.strip().str.lower().str.replace(r'\.0$', '', regex=True)
+    booleans = values.map(BOOL_VALUES)
+    if (booleans.isna() & ~missing).any():
+        _lossy(column, series, booleans.isna() & ~missing, 'are not booleans')
+    return booleans.astype('boolean')
+
+def _lossyDecimals(column, series, missing, error):
+    def toDecimal(value):
+        try:
+            return Decimal(str(value).strip())
+        except InvalidOperation:
+            return None
+
+    decimals = series.where(~missing).map(toDecimal, na_action='ignore')
+    if (decimals.isna() & ~missing).any():
+        _lossy(column, series, decimals.isna() & ~missing, 'are not numeric')
+    inexact = decimals.map(lambda value: isinstance(value, Decimal) and value != value.quantize(MONEY_SCALE)).astype(bool)
+    if inexact.any():
+        _lossy(column, series, inexact, f'have more decimals than {MONEY_SCALE}')
+    overflow = decimals.map(lambda value: isinstance(value, Decimal) and abs(value) >= MONEY_LIMIT).astype(bool)
+    if overflow.any():
+        _lossy(column, series, overflow, 'overflow DECIMAL(19,4)')
+    # Values Arrow rejects for another reason than the checks above
+    raise LossyCastError(f"{column}: can't be cast to DECIMAL(19,4), {error}")
+
+def castDecimal(column, series):
+    money = MONEY_DTYPE.pyarrow_dtype
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        # A number is exact when it's the float of its value rounded to the scale, as its shortest representation then fits the scale
+        numbers = series.astype('float64')
+        present = numbers.notna()
+        inexact = present & (np.round(numbers * 10 ** money.scale) / 10 ** money.scale != numbers)
+        if inexact.any():
+            _lossy(column, series, inexact, f'have more decimals than {MONEY_SCALE}')
+        overflow = present & (numbers.abs() >= MONEY_LIMIT)
+        if overflow.any():
+            _lossy(column, series, overflow, 'overflow DECIMAL(19,4)')
+        try:
+            decimals = pc.cast(pa.array(numbers, from_pandas=True), money)
+        except pa.ArrowInvalid as e:
+            _lossyDecimals(column, series, ~present, e)
+    else:
+        try:
+            strings = pa.array(series, type=pa.string(), from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError): # Mixed types
+            strings = pa.array(series.astype(str).where(series.notna(), None), type=pa.string())
+        # Empty strings count as missing values
+        strings = pc.utf8_trim_whitespace(strings)
+        strings = pc.if_else(pc.equal(strings, ''), pa.scalar(None, pa.string()), strings)
+        try:
+            # Arrow parses every string and checks its range and scale at once, without a Python object per value
+            decimals = pc.cast(strings, money)
+        except pa.ArrowInvalid as e:
+            # Only a failed cast goes through the values one by one, to report the lossy ones
+            _lossyDecimals(column, series, pd.Series(strings.is_null().to_numpy(zero_copy_only=False), index=series.index), e)
+    return pd.Series(pd.arrays.ArrowExtensionArray(decimals), index=series.index, name=series.name)
+
+def castDate(column, series):
+    missing = _missing(series)
+    dates = pd.to_datetime(series.where(~missing), format=DATE_FORMAT, errors='coerce')
+    if (dates.isna() & ~missing).any():
+        _lossy(column, series, dates.isna() & ~missing, f'are not dates ({DATE_FORMAT})')
+    if (dates.notna() & (dates != dates.dt.normalize())).any():
+        _lossy(column, series, dates.notna() & (dates != dates.dt.normalize()), 'have a time of day')
+    return dates
+
+def castCategory(column, series):
+    if len(series) > 0 and series.nunique() <= CATEGORY_RATIO * len(series):
+        return series.astype('category')
+    return series
+
+"""
+Keeps Arrow decimals as fixed-point Arrow dtypes when converting Arrow tables to pandas (to_pandas types_mapper)
+- Other types use the pandas defaults
+"""
+def decimalTypes(arrow_type):
+    return pd.ArrowDtype(arrow_type) if pa.types.is_decimal(arrow_type) else None
+
+"""
+Casts a column to the compact dtype of its column type (COLUMN_NAME_type)
+- Raises LossyCastError when values would be lost
+"""
+def castColumn(column, series, dtype):
+    if str(series.dtype) == dtype or (dtype == 'decimal' and series.dtype == MONEY_DTYPE):
+        return series
+    if dtype in ('Int32', 'Int64'):
+        return castInteger(column, series, dtype)
+    if dtype == 'float64':
+        return castFloat(column, series)
+    if dtype == 'boolean':
+        return castBoolean(column, series)
+    if dtype == 'decimal':
+        return castDecimal(column, series)
+    if dtype == 'datetime64[ns]':
+        return castDate(column, series)
+    if dtype == 'category':
+        return castCategory(column, series)
+    return series
+
+"""
+Casts every typed column of a renamed dataframe to its compact dtype
+- Columns that aren't in renames.json are left as they are
+- Logs the memory usage before and after
+"""
+def castTypes(dataframe, table_name=''):
+    dtypes = getSchema().pandas_dtypes
+    before = dataframe.memory_usage(deep=True).sum()
+
+    dataframe = dataframe.copy()
+    for column in dataframe.columns:
+        if column in dtypes:
+            dataframe[column] = castColumn(column, dataframe[column], dtypes[column])
+
+    after = dataframe.memory_usage(deep=True).sum()
+    logger.info(f"Typed {table_name}: {before / 2**20:.2f} MB -> {after / 2**20:.2f} MB")
+    return dataframe
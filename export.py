@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from loguru import logger
+from tableutils import rowHashes
+from dtypes import decimalTypes
+from instrumentation import measure
+
+MANIFEST = '_manifest.json'
+STAGING = '_staging'
+COMPRESSION = 'zstd'
+
+"""
+Partition of rows without a date, named like Hive names missing partition values
+"""
+MISSING = '__HIVE_DEFAULT_PARTITION__'
+
+"""
+Exports the loaded tables as compressed Parquet files, one directory per table
+- The chunks of a table are staged while they're loaded (observe), export() writes its files once the table is loaded
+- Partitioned tables (TableSpec.partition) get a year=yyyy/month=mm directory per month, other tables a single file
+- Only files whose content changed are rewritten, every file is written to a temporary file and renamed
+- A manifest per table records the rows, size and column ranges of every file, so readers can prune partitions
+"""
+class ParquetExport:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def tableDir(self, table):
+        return os.path.join(self.directory, table)
+
+    def stagingDir(self, table):
+        return os.path.join(self.directory, STAGING, table)
+
+    """
+    Stages the chunks of a table as they pass through
+    - start is the number of chunks an interrupted run already staged, chunks continues after them
+    """
+    def observe(self, table, chunks, start=0):
+        staging = self.stagingDir(table)
+        if start == 0:
+            shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging, exist_ok=True)
+        for i, chunk in enumerate(chunks, start=start):
+            chunk.to_parquet(os.path.join(staging, f'{i:06}.parquet'), engine='pyarrow', index=False)
+            yield chunk
+
+    """
+    Reads the staged chunks of a table one at a time, with the schema of all of them (stagedSchema)
+    """
+    def staged(self, table):
+        staging = self.stagingDir(table)
+        paths = [os.path.join(staging, name) for name in sorted(os.listdir(staging))]
+        if not paths:
+            raise FileNotFoundError(f"{table} has no staged chunks to export")
+        schema = stagedSchema([pq.read_schema(path) for path in paths])
+        for path in paths:
+            yield pq.read_table(path).cast(schema)
+
+    """
+    Gets the manifest of an exported table, empty when it wasn't exported yet
+    """
+    def manifest(self, table):
+        try:
+            with open(os.path.join(self.tableDir(table), MANIFEST)) as f_in:
+                return json.load(f_in)
+        except (OSError, ValueError):
+            return {}
+
+    """
+    Reads columns of an exported table from the files in its manifest
+    """
+    def read(self, table, columns=None):
+        files = self.manifest(table).get('files', {})
+        frames = [pd.read_parquet(os.path.join(self.tableDir(table), path), engine='pyarrow', columns=columns) for path in files]
+        return pd.concat(frames, ignore_index=True)
+
+    """
+    Looks up a column of an exported table by its key, only reading the rows of the given keys
+    """
+    def lookup(self, table, key, column, keys):
+        files = [os.path.join(self.tableDir(table), path) for path in self.manifest(table).get('files', {})]
+        dataset = ds.dataset(files, format='parquet')
+        keys = pa.array(pd.Series(keys).dropna().unique()).cast(dataset.schema.field(key).type)
+        found = dataset.to_table(columns=[key, column], filter=pc.field(key).isin(keys)).to_pandas(types_mapper=decimalTypes)
+        return found.drop_duplicates(key, keep='last').set_index(key)[column]
+
+    """
+    Writes the files of a loaded table from its staged chunks, one chunk in memory at a time
+    - A first pass hashes and measures every file, a second one only writes the files whose content changed
+    - Tables partitioned through another table (TableSpec.partition_join) look their dates up in its export
+    """
+    def export(self, spec):
+        table = spec.table_name
+        directory = self.tableDir(table)
+        with measure('export', table) as measurement:
+            previous = self.manifest(table).get('files', {})
+
+            files, digests = {}, {}
+            for chunk in self.staged(table):
+                dataframe = chunk.to_pandas(types_mapper=decimalTypes)
+                hashes = rowHashes(dataframe).to_numpy()
+                for path, partition, rows in partitions(spec, dataframe, self):
+                    if path not in files:
+                        files[path] = {**partition, 'rows': 0, 'bytes': 0, 'hash': None, 'columns': {}}
+                        digests[path] = contentHash(dataframe.columns)
+                    frame = dataframe.iloc[rows]
+                    digests[path].update(hashes[rows].tobytes())
+                    files[path]['rows'] += len(frame)
+                    mergeRanges(files[path]['columns'], columnRanges(frame))
+
+            changed = set()
+            for path, file in files.items():
+                file['hash'] = digests[path].hexdigest()
+                known = previous.get(path)
+                if known is not None and known['hash'] == file['hash'] and os.path.exists(os.path.join(directory, path)):
+                    files[path] = known
+                else:
+                    changed.add(path)
+
+            if changed:
+                writers = {}
+                try:
+                    for chunk in self.staged(table):
+                        for path, _, rows in partitions(spec, chunk.to_pandas(types_mapper=decimalTypes), self):
+                            if path not in changed:
+                                continue
+                            if path not in writers:
+                                target = os.path.join(directory, path)
+                                os.makedirs(os.path.dirname(target), exist_ok=True)
+                                writers[path] = pq.ParquetWriter(f'{target}.tmp', chunk.schema, compression=COMPRESSION)
+                            writers[path].write_table(chunk.take(pa.array(rows, type=pa.int64())))
+                finally:
+                    for writer in writers.values():
+                        writer.close()
+                for path in changed:
+                    target = os.path.join(directory, path)
+                    os.replace(f'{target}.tmp', target)
+                    files[path]['bytes'] = os.path.getsize(target)
+
+            # Readers only see the new files once the manifest points to them
+            manifest = {
+                'table': table,
+                'partition': spec.partition,
+                'compression': COMPRESSION,
+                'rows': sum(file['rows'] for file in files.values()),
+                'bytes': sum(file['bytes'] for file in files.values()),
+                'files': files,
+            }
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f'{MANIFEST}.tmp'), 'w') as f_out:
+                json.dump(manifest, f_out, indent=4)
+            os.replace(os.path.join(directory, f'{MANIFEST}.tmp'), os.path.join(directory, MANIFEST))
+
+            for path in previous.keys() - files.keys():
+                os.remove(os.path.join(directory, path))
+                removeEmptyDirs(os.path.dirname(os.path.join(directory, path)), directory)
+            shutil.rmtree(self.stagingDir(table), ignore_errors=True)
+
+            logger.info(f"Exported {table}: {len(files)} files, {len(changed)} rewritten")
+            measurement.rows_out = manifest['rows']
+            measurement.bytes = manifest['bytes']
+
+"""
+Gets the schema every staged chunk of a table is read as, like the dtypes of the chunks concatenated
+- A column that's only null in some chunks gets the type of the others
+- Categories that differ between chunks are staged as plain values by some and as dictionaries by others, those are decoded
+"""
+def stagedSchema(schemas):
+    mixed = {field.name for field in schemas[0] if len({schema.field(field.name).type for schema in schemas}) > 1}
+    decoded = [
+        pa.schema([
+            field.with_type(field.type.value_type) if field.name in mixed and pa.types.is_dictionary(field.type) else field
+            for field in schema
+        ], metadata=schema.metadata)
+        for schema in schemas
+    ]
+    return pa.unify_schemas(decoded, promote_options='permissive')
+
+"""
+Splits the rows of a table into the files it's exported as
+- Yields the path, the partition values and the row positions of every file
+- Dates partition by their year and month, YEAR_number columns by themselves and their MONTH_number column
+"""
+def partitions(spec, dataframe, export: ParquetExport):
+    if spec.partition is None:
+        yield 'data.parquet', {}, range(len(dataframe))
+        return
+
+    if spec.partition_join is not None:
+        # The partition column belongs to another table, e.g. the order date of order details
+        join = spec.partition_join
+        values = dataframe[join.on].map(export.lookup(join.source, join.on, spec.partition, dataframe[join.on]))
+    else:
+        values = dataframe[spec.partition]
+
+    if spec.partition.endswith('_date'):
+        dates = pd.to_datetime(values)
+        years, months = dates.dt.year, dates.dt.month
+    else:
+        years, months = values, dataframe[spec.partition.replace('YEAR', 'MONTH')]
+
+    months = pd.DataFrame({'year': years, 'month': months}).astype('Int64')
+    months[months.isna().any(axis=1)] = pd.NA
+    for (year, month), rows in months.groupby(['year', 'month'], dropna=False).indices.items():
+        if pd.isna(year) or pd.isna(month):
+            yield f'year={MISSING}/month={MISSING}/data.parquet', {'year': None, 'month': None}, rows
+        else:
+            yield f'year={year}/month={month:02}/data.parquet', {'year': int(year), 'month': int(month)}, rows
+
+"""
+Starts the hash of the content of a file, the row hashes (rowHashes) of its rows are added chunk by chunk, independent of dtypes
+"""
+def contentHash(columns):
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update('\0'.join(columns).encode())
+    return digest
+
+"""
+Gets the smallest and largest value of every numeric and date column, readers skip files outside their filter
+"""
+def columnRanges(dataframe):
+    ranges = {}
+    for column in dataframe.columns:
+        series = dataframe[column].dropna()
+        if len(series) == 0:
+            continue
+        if pd.api.types.is_datetime64_any_dtype(series):
+            ranges[column] = [series.min().isoformat(), series.max().isoformat()]
+        elif pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            # numpy scalars as Python numbers, decimals as floats
+            ranges[column] = [value.item() if hasattr(value, 'item') else float(value) for value in (series.min(), series.max())]
+    return ranges
+
+"""
+Widens the column ranges of a file by those of another chunk of its rows
+"""
+def mergeRanges(ranges, chunk_ranges):
+    for column, (low, high) in chunk_ranges.items():
+        ranges[column] = [min(ranges[column][0], low), max(ranges[column][1], high)] if column in ranges else [low, high]
+
+def removeEmptyDirs(path, root):
+    while os.path.abspath(path) != os.path.abspath(root) and not os.listdir(path):
+        os.rmdir(path)
+        path = os.path.dirname(path)
@@ -0,0 +1,155 @@
+import os
+import pandas as pd
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from settings import Settings
+from tableutils import getSqlite, getCSV
+from instrumentation import measure, frameBytes
+from cache import getCache
+
+"""
+SQLite databases to extract, keyed by the prefix used in the registry
+"""
+SQLITE_SOURCES = {
+    'sales': 'go_sales.sqlite',
+    'staff': 'go_staff.sqlite',
+    'crm': 'go_crm.sqlite',
+}
+
+"""
+CSV exports to extract, registered as csv.<name>
+"""
+CSV_SOURCES = {
+    'inventory_level': 'GO_SALES_INVENTORY_LEVELSData.csv',
+    'sales_forecast': 'GO_SALES_PRODUCT_FORECASTData.csv',
+}
+
+SELECT_TABLES = "SELECT name FROM sqlite_master WHERE type='table'"
+
+"""
+Lists the user tables of a SQLite database
+- SQLite internal tables (sqlite_sequence, ...) are skipped
+"""
+def listTables(settings: Settings, filename):
+    con = getSqlite(settings, filename)
+    try:
+        tables = pd.read_sql_query(SELECT_TABLES, con)
+    finally:
+        con.close()
+    return [table for table in tables['name'] if not table.startswith('sqlite_')]
+
+"""
+Reads a source table through the extraction cache when one is configured
+- Cache hits are measured as the cached stage
+"""
+def cachedRead(cache, path, query, read, measurement):
+    if cache is None:
+        return read()
+
+    key = cache.key(path, query)
+    dataframe = cache.get(key)
+    if dataframe is None:
+        dataframe = read()
+        cache.put(key, dataframe)
+    else:
+        measurement.stage = 'cached'
+    return dataframe
+
+"""
+Reads a full table from a SQLite database
+- sqlite3 connections can't be shared between threads, so every read opens its own
+"""
+def readTable(settings: Settings, filename, table, cache=None):
+    query = f'SELECT * FROM "{table}";'
+
+    def read():
+        con = getSqlite(settings, filename)
+        try:
+            return pd.read_sql_query(query, con)
+        finally:
+            con.close()
+
+    with measure('extract', f"{os.path.splitext(filename)[0]}.{table}") as measurement:
+        dataframe = cachedRead(cache, os.path.join(settings.data_dir, filename), query, read, measurement)
+        measurement.rows_out = len(dataframe)
+        measurement.bytes = frameBytes(dataframe)
+    return dataframe
+
+"""
+Reads a full CSV export
+"""
+def readCSV(settings: Settings, filename, cache=None):
+    with measure('extract', filename) as measurement:
+        dataframe = cachedRead(cache, os.path.join(settings.data_dir, filename), 'read_csv', lambda: getCSV(settings, filename), measurement)
+        measurement.rows_out = len(dataframe)
+        measurement.bytes = frameBytes(dataframe)
+    return dataframe
+
+"""
+Reads a registry table (<source>.<table>) in chunks of chunk_size rows
+- Only one chunk is in memory at a time
+- Every chunk is measured as its own extract
+"""
+def readChunks(settings: Settings, name, chunk_size):
+    chunks = iterChunks(settings, name, chunk_size)
+    while True:
+        with measure('extract', name) as measurement:
+            chunk = next(chunks, None)
+            if chunk is not None:
+                measurement.rows_out = len(chunk)
+                measurement.bytes = frameBytes(chunk)
+        if chunk is None:
+            return
+        yield chunk
+
+def iterChunks(settings: Settings, name, chunk_size):
+    source, table = name.split('.', 1)
+    if source == 'csv':
+        yield from getCSV(settings, CSV_SOURCES[table], chunksize=chunk_size)
+        return
+
+    con = getSqlite(settings, SQLITE_SOURCES[source])
+    try:
+        yield from pd.read_sql_query(f'SELECT * FROM "{table}";', con, chunksize=chunk_size)
+    finally:
+        con.close()
+
+"""
+Extracts every source table concurrently
+- Tables are discovered through sqlite_master
+- At most max_workers tables are read at the same time
+- Tables in skip (streamed tables) aren't read
+- With only, just those tables are read
+- With Settings.cache_dir unchanged tables are memory-mapped from the extraction cache
+- aliases maps tables to an identical copy (catalog.sourceAliases), they're registered as that copy instead of read again
+- Returns a registry of DataFrames keyed by <source>.<table> (csv.<name> for the CSV files)
+"""
+def extractSources(settings: Settings, max_workers=4, skip=(), only=None, aliases=None):
+    start = time.perf_counter()
+    cache = getCache(settings)
+    aliases = aliases or {}
+    if only is not None:
+        only = set(only) | {aliases[name] for name in only if name in aliases}
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for source, filename in SQLITE_SOURCES.items():
+            for table in listTables(settings, filename):
+                if f'{source}.{table}' in aliases:
+                    continue
+                if f'{source}.{table}' not in skip and (only is None or f'{source}.{table}' in only):
+                    futures[f'{source}.{table}'] = pool.submit(readTable, settings, filename, table, cache)
+
+        for name, filename in CSV_SOURCES.items():
+            if f'csv.{name}' not in skip and (only is None or f'csv.{name}' in only):
+                futures[f'csv.{name}'] = pool.submit(readCSV, settings, filename, cache)
+
+        registry = {name: future.result() for name, future in futures.items()}
+
+    for alias, name in aliases.items():
+        if name in registry and (only is None or alias in only):
+            registry[alias] = registry[name]
+
+    logger.info(f"Extracted {len(registry)} tables in {time.perf_counter() - start:.2f}s")
+    return registry
@@ -0,0 +1,146 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from loguru import logger
+from settings import Settings
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+@dataclass
+class Measurement:
+    stage: str
+    """Name of the ETL stage (extract, merge, rename, create, insert, ...)"""
+    table: str
+    """Source or Data Warehouse table the stage worked on"""
+    seconds: float = 0.0
+    """Wall time of the stage"""
+    rows_in: int = None
+    """Rows the stage received"""
+    rows_out: int = None
+    """Rows the stage produced or wrote"""
+    bytes: int = None
+    """Memory usage of the produced dataframe"""
+    peak_rss: int = None
+    """Peak resident set size of the process in bytes when the stage finished"""
+    rows_per_second: float = None
+    """Throughput over rows_out (or rows_in when nothing is produced)"""
+    error: str = None
+    """Exception the stage failed with, None when it succeeded"""
+
+_lock = threading.Lock()
+_measurements = []
+_sink = None
+
+"""
+Peak resident set size of the process in bytes, None when the platform doesn't report it
+"""
+def peakRss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+"""
+Deep memory usage of a dataframe in bytes
+"""
+def frameBytes(dataframe):
+    return int(dataframe.memory_usage(deep=True).sum())
+
+"""
+Measures a stage of a table
+- Yields the Measurement so the stage can fill in rows_out and bytes
+- Finished measurements are logged with all their fields and kept for the summary
+- Stages that raise are recorded too, with the exception in error, and the exception is raised again
+"""
+@contextmanager
+def measure(stage, table='', rows_in=None):
+    measurement = Measurement(stage=stage, table=table, rows_in=rows_in)
+    start = time.perf_counter()
+    try:
+        yield measurement
+    except BaseException as e:
+        measurement.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        measurement.seconds = time.perf_counter() - start
+        measurement.peak_rss = peakRss()
+        rows = measurement.rows_out if measurement.rows_out is not None else measurement.rows_in
+        if rows is not None and measurement.seconds > 0:
+            measurement.rows_per_second = rows / measurement.seconds
+
+        with _lock:
+            _measurements.append(measurement)
+        message = f"{measurement.stage} {measurement.table}: {measurement.seconds:.2f}s" \
+            + (f", {rows} rows ({measurement.rows_per_second or 0:.0f} rows/s)" if rows is not None else '')
+        if measurement.error is None:
+            logger.bind(**asdict(measurement)).info(message)
+        else:
+            logger.bind(**asdict(measurement)).error(f"{message}, failed with {measurement.error}")
+
+"""
+Starts recording a run
+- Measurements are written as JSON lines to etl_<time>.json in settings.log_dir
+"""
+def startRun(settings: Settings):
+    global _sink
+    with _lock:
+        _measurements.clear()
+    os.makedirs(settings.log_dir, exist_ok=True)
+    _sink = logger.add(
+        os.path.join(settings.log_dir, 'etl_{time:YYYYMMDD_HHmmss}.json'),
+        serialize=True,
+        filter=lambda record: 'stage' in record['extra'] or 'summary' in record['extra'],
+    )
+
+"""
+Totals the measurements per table and stage, slowest first
+- A total keeps the error of its first failed measurement
+"""
+def summarize(measurements):
+    totals = {}
+    for measurement in measurements:
+        key = (measurement.table, measurement.stage)
+        total = totals.setdefault(key, Measurement(stage=measurement.stage, table=measurement.table, rows_out=0))
+        total.seconds += measurement.seconds
+        total.rows_out += measurement.rows_out if measurement.rows_out is not None else (measurement.rows_in or 0)
+        total.bytes = max(total.bytes or 0, measurement.bytes or 0) or None
+        total.peak_rss = max(total.peak_rss or 0, measurement.peak_rss or 0) or None
+        total.error = total.error or measurement.error
+
+    for total in totals.values():
+        total.rows_per_second = total.rows_out / total.seconds if total.seconds > 0 else None
+    return sorted(totals.values(), key=lambda total: total.seconds, reverse=True)
+
+"""
+Formats the totals as a text table
+"""
+def summaryTable(totals):
+    lines = [f"{'table':<36} {'stage':<10}{'seconds':>10}{'rows':>12}{'rows/s':>12}{'MB':>10}{'peak MB':>10}"]
+    for total in totals:
+        lines.append(
+            f"{total.table:<36} {total.stage:<10}{total.seconds:>10.2f}{total.rows_out:>12}"
+            f"{total.rows_per_second or 0:>12.0f}{(total.bytes or 0) / 2**20:>10.2f}{(total.peak_rss or 0) / 2**20:>10.0f}"
+            + (f"  failed: {total.error}" if total.error is not None else ''))
+    return '\n'.join(lines)
+
+"""
+Finishes recording a run
+- Logs the summary table and writes the totals to the JSON log
+- Returns the totals
+"""
+def finishRun():
+    global _sink
+    with _lock:
+        totals = summarize(_measurements)
+    logger.bind(summary=[asdict(total) for total in totals]).info("Run summary\n" + summaryTable(totals))
+    if _sink is not None:
+        logger.remove(_sink)
+        _sink = None
+    return totals
@@ -1,12 +1,20 @@
+import argparse
 from processing import run
 from settings import Settings
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Loads the Great Outdoors sales data into the Data Warehouse")
+    parser.add_argument('--resume', action='store_true', help="Continue the interrupted run instead of starting over")
+    args = parser.parse_args()
+
     settings = Settings(
         server="DESKTOP-9F8A8PF\\MSSQLSERVER01",
         database="Datawarehouse",
         data_dir="data/",
-        log_dir="logs/"
+        log_dir="logs/",
+        checkpoint_dir="checkpoint/",
+        export_dir="export/",
+        resume=args.resume
     )
 
     run(settings)
\ No newline at end of file
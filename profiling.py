@@ -0,0 +1,165 @@
+import re
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from tableutils import columnType
+from instrumentation import measure
+
+"""
+Integer SQL types from narrow to wide with their value range
+"""
+INTEGER_TYPES = [
+    ('TINYINT', 0, 2**8 - 1),
+    ('SMALLINT', -2**15, 2**15 - 1),
+    ('INT', -2**31, 2**31 - 1),
+    ('BIGINT', -2**63, 2**63 - 1),
+]
+
+"""
+Longest VARCHAR and NVARCHAR that isn't MAX
+"""
+VARCHAR_LENGTH = 8000
+NVARCHAR_LENGTH = 4000
+
+"""
+Shortest profiled text length, lengths are rounded up to a power of two from there so later rows have room to grow
+"""
+MIN_LENGTH = 16
+
+"""
+Narrowest integer type of key columns (_id), later keys quickly outgrow the first ones
+"""
+KEY_TYPE = 'INT'
+
+"""
+Precisions at which DECIMAL takes more storage, profiled precisions are rounded up to the next one
+"""
+DECIMAL_PRECISIONS = [9, 19, 28, 38]
+
+TEXT = re.compile(r'^(N?)(VAR)?CHAR\((\d+|MAX)\)$')
+DECIMAL = re.compile(r'^DECIMAL\((\d+),(\d+)\)$')
+
+@dataclass
+class ColumnProfile:
+    column: str
+    """Data Warehouse column"""
+    default: str
+    """SQL type of the column type (columnType)"""
+    count: int = 0
+    """Number of present values"""
+    max_length: int = None
+    """Longest string, for text columns"""
+    ascii: bool = None
+    """Whether every string is ASCII only, for text columns"""
+    minimum: float = None
+    """Smallest value, for numeric columns"""
+    maximum: float = None
+    """Largest value, for numeric columns"""
+    integer_digits: int = None
+    """Digits before the decimal point of the largest absolute value, for decimal columns"""
+    scale: int = None
+    """Digits after the decimal point needed by every value, for decimal columns"""
+
+"""
+Gets the number of decimals every value needs, at most max_scale
+"""
+def requiredScale(numbers, max_scale):
+    numbers = numbers.to_numpy()
+    for scale in range(max_scale + 1):
+        if np.allclose(numbers, numbers.round(scale), rtol=0, atol=10 ** -(max_scale + 2)):
+            return scale
+    return max_scale
+
+"""
+Profiles the values of a staged column
+- Text columns get their longest string and whether they're ASCII only
+- Integer and decimal columns get their range, decimal columns also the digits before and after the point
+"""
+def profileColumn(column, series):
+    default = columnType(column)
+    values = series.dropna()
+    profile = ColumnProfile(column, default, count=len(values))
+    if len(values) == 0:
+        return profile
+
+    if TEXT.match(default):
+        # Only the distinct values of categories have to be measured
+        strings = pd.Series(series.cat.categories).astype(str) if isinstance(series.dtype, pd.CategoricalDtype) else values.astype(str)
+        profile.max_length = int(strings.str.len().max())
+        profile.ascii = not strings.str.contains(r'[^\x00-\x7f]').any()
+    elif default in ('INT', 'BIGINT') or DECIMAL.match(default):
+        # The range and scale only depend on the distinct values
+        numbers = pd.Series(values.unique())
+        numbers = numbers.astype('float64') if pd.api.types.is_numeric_dtype(numbers) else pd.to_numeric(numbers.astype(object), errors='coerce').astype('float64')
+        profile.minimum = float(numbers.min())
+        profile.maximum = float(numbers.max())
+        decimal = DECIMAL.match(default)
+        if decimal:
+            largest = int(numbers.abs().max())
+            profile.integer_digits = len(str(largest)) if largest > 0 else 0
+            profile.scale = requiredScale(numbers, int(decimal[2]))
+    return profile
+
+"""
+Gets a narrow SQL type that holds every profiled value, never wider than the type of the column type
+- Fixed CHAR(n) columns keep their length, NCHAR(n) when a column holds non-ASCII text
+- (N)VARCHAR(n) of the longest string rounded up to a power of two (at least MIN_LENGTH) and at most the declared length,
+  VARCHAR when every string is ASCII, MAX beyond the longest fixed length
+- Integer and decimal columns keep their declared type, key columns (_id) at least KEY_TYPE, so the rows of later
+  incremental loads still fit
+- Values that don't fit the declared type widen it: text as above, integers to the narrowest wider type and decimals to
+  the next storage size of their precision
+- Columns without values and other types keep the type of their column type
+"""
+def profiledType(profile: ColumnProfile, key=False):
+    if profile.count == 0:
+        return profile.default
+
+    if profile.max_length is not None:
+        _, variable, declared = TEXT.match(profile.default).groups()
+        national = '' if profile.ascii else 'N'
+        fits = declared != 'MAX' and profile.max_length <= int(declared)
+        if not variable and fits:
+            return f'{national}CHAR({declared})'
+        length = max(MIN_LENGTH, 1 << (max(profile.max_length, 1) - 1).bit_length())
+        if fits:
+            length = min(length, int(declared))
+        limit = VARCHAR_LENGTH if profile.ascii else NVARCHAR_LENGTH
+        return f'{national}VARCHAR({min(length, limit)})' if profile.max_length <= limit else f'{national}VARCHAR(MAX)'
+
+    if profile.scale is not None:
+        precision, scale = map(int, DECIMAL.match(profile.default).groups())
+        if profile.integer_digits <= precision - scale and profile.scale <= scale:
+            return profile.default
+        # The scale never exceeds the declared one (requiredScale), only the integer digits outgrow the precision
+        needed = profile.integer_digits + scale
+        if needed > DECIMAL_PRECISIONS[-1]:
+            return profile.default
+        precision = next(precision for precision in DECIMAL_PRECISIONS if needed <= precision)
+        return f'DECIMAL({precision},{scale})'
+
+    if profile.minimum is not None:
+        names = [sql_type for sql_type, _, _ in INTEGER_TYPES]
+        narrowest = names.index(profile.default) if profile.default in names else 0
+        if key:
+            narrowest = max(narrowest, names.index(KEY_TYPE))
+        for sql_type, low, high in INTEGER_TYPES[narrowest:]:
+            if low <= profile.minimum and profile.maximum <= high:
+                return sql_type
+    return profile.default
+
+"""
+Gets the SQL type of every column of a staged table
+- With profile the types are right-sized from the data (profileColumn), otherwise the column types are used (columnType)
+- Overrides of the spec (TableSpec.types) always win
+"""
+def tableTypes(spec, dataframe, profile=False):
+    if not profile:
+        return {column: spec.types.get(column) or columnType(column) for column in dataframe.columns}
+
+    with measure('profile', spec.table_name, len(dataframe)):
+        return {
+            column: spec.types.get(column)
+                or profiledType(profileColumn(column, dataframe[column]), key=column == spec.PK or column.endswith('_id'))
+            for column in dataframe.columns
+        }
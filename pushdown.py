@@ -0,0 +1,124 @@
+import dataclasses
+import os
+import sqlite3
+import pandas as pd
+from settings import Settings
+from schema import getSchema
+from extract import SQLITE_SOURCES
+from specs import RECONCILED, TableSpec
+from instrumentation import measure, frameBytes
+
+"""
+Opens one read-only connection with every SQLite source attached under its registry prefix
+- sales.product in the registry is sales.product in SQL
+"""
+def attachSources(settings: Settings):
+    con = sqlite3.connect('file::memory:', uri=True)
+    for source, filename in SQLITE_SOURCES.items():
+        path = os.path.abspath(os.path.join(settings.data_dir, filename))
+        con.execute(f"ATTACH DATABASE ? AS {source}", (f'file:{path}?mode=ro',))
+    return con
+
+"""
+Gets the columns of a registry table (<source>.<table>) in table order
+"""
+def tableColumns(con, name):
+    source, table = name.split('.', 1)
+    return [row[1] for row in con.execute(f'PRAGMA {source}.table_info("{table}")')]
+
+"""
+Whether the source and every join of a spec are plain SQLite tables
+- CSV exports and the reconciled tables (merged in pandas with conflict checks) can't be pushed down
+- Neither can tables in routed, differing copies that are merged in pandas (catalog.findDuplicates)
+"""
+def isPushable(spec: TableSpec, routed=()):
+    reconciled = {name for name, *_ in RECONCILED}
+    names = [spec.source] + [join.source for join in spec.joins]
+    return all(name.split('.', 1)[0] in SQLITE_SOURCES and name not in reconciled and name not in routed for name in names)
+
+"""
+Gets the registry tables a list of specs reads when they aren't pushed down
+- Reconciled tables are replaced by the two tables they're merged from, which are always read
+"""
+def requiredSources(specs):
+    reconciled = {name: (first, second) for name, first, second, *_ in RECONCILED}
+    required = {name for pair in reconciled.values() for name in pair}
+    for spec in specs:
+        for name in [spec.source] + [join.source for join in spec.joins]:
+            required.update(reconciled.get(name, (name,)))
+    return required
+
+"""
+Whether a merged column survives renaming, excluding and filtering
+"""
+def isLoaded(spec: TableSpec, column):
+    renames = getSchema().renames
+    renamed = renames.get(column, column)
+    renamed = spec.renames.get(renamed, renamed)
+    return renamed in getSchema().valid_columns and renamed not in spec.exclude
+
+"""
+Generates the query that runs the joins of a spec inside SQLite
+- Columns get the names pd.merge would give them (_x/_y on collisions), so the rest of the transform is unchanged
+- Only the columns that are loaded or derived from are selected
+- Rows keep the order of the main source, like an inner pd.merge
+"""
+def pushdownQuery(con, spec: TableSpec):
+    # Merged column name -> SQL expression
+    columns = {column: f't0."{column}"' for column in tableColumns(con, spec.source) if column not in spec.drop}
+    joins = ''
+    for i, join in enumerate(spec.joins, start=1):
+        right = {column: f't{i}."{column}"' for column in tableColumns(con, join.source) if column != join.on}
+        joins += f' INNER JOIN {join.source} t{i} ON {columns[join.on]} = t{i}."{join.on}"'
+
+        merged = {}
+        for column, expression in columns.items():
+            merged[f'{column}_x' if column in right else column] = expression
+        for column, expression in right.items():
+            merged[f'{column}_y' if column in columns else column] = expression
+        columns = {join.rename.get(column, column): expression for column, expression in merged.items() if column not in join.exclude}
+
+    inputs = {column for derive in spec.derived for column in derive.inputs}
+    selected = [f'{expression} AS "{column}"' for column, expression in columns.items() if column in inputs or isLoaded(spec, column)]
+    return f'SELECT {", ".join(selected)} FROM {spec.source} t0{joins} ORDER BY t0.rowid'
+
+"""
+Gets the spec that transforms the result of pushdownQuery
+- The joins and drops already happened in SQLite
+"""
+def pushedSpec(spec: TableSpec):
+    return dataclasses.replace(spec, source=f'pushed.{spec.table_name}', joins=[], drop=[])
+
+"""
+Reads the joined and projected source of a spec from SQLite
+- With chunk_size an iterator of dataframes of chunk_size rows is returned
+"""
+def readPushed(settings: Settings, spec: TableSpec, chunk_size=None):
+    if chunk_size:
+        return readPushedChunks(settings, spec, chunk_size)
+
+    with measure('extract', f'pushed.{spec.table_name}') as measurement:
+        con = attachSources(settings)
+        try:
+            dataframe = pd.read_sql_query(pushdownQuery(con, spec), con)
+        finally:
+            con.close()
+        measurement.rows_out = len(dataframe)
+        measurement.bytes = frameBytes(dataframe)
+    return dataframe
+
+def readPushedChunks(settings: Settings, spec: TableSpec, chunk_size):
+    con = attachSources(settings)
+    try:
+        chunks = pd.read_sql_query(pushdownQuery(con, spec), con, chunksize=chunk_size)
+        while True:
+            with measure('extract', f'pushed.{spec.table_name}') as measurement:
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    measurement.rows_out = len(chunk)
+                    measurement.bytes = frameBytes(chunk)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        con.close()
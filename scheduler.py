@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from loguru import logger
+
+"""
+Builds the task DAG of loading a list of table specs
+- transform:<table> has no dependencies
+- load:<table> runs after transform:<table>
+- surrogates:<foreign table> resolves every link to a table at once, after it and every table linking to it are loaded,
+  so its lookup is built once (updateSurrogates)
+- With validate, every load waits for a validate task that runs after all transforms
+- aggregate:<table> runs after every table the aggregate is computed from is loaded
+- With export, export:<table> runs after the table is loaded and the table its partitions are looked up from is exported
+- Every task function gets the results of the finished tasks
+"""
+def buildTasks(specs, transform, load, resolve, validate=None, aggregates=(), aggregate=None, export=None):
+    tasks = {}
+    if validate is not None:
+        tasks['validate'] = (
+            lambda results: validate({spec.table_name: results[f'transform:{spec.table_name}'] for spec in specs}),
+            [f'transform:{spec.table_name}' for spec in specs]
+        )
+
+    for spec in specs:
+        name = spec.table_name
+        tasks[f'transform:{name}'] = (lambda results, spec=spec: transform(spec), [])
+
+        if not spec.load:
+            continue
+        tasks[f'load:{name}'] = (
+            lambda results, spec=spec: load(spec, results[f'transform:{spec.table_name}']),
+            [f'transform:{name}'] + (['validate'] if validate is not None else [])
+        )
+
+        if export is not None:
+            tasks[f'export:{name}'] = (
+                lambda results, spec=spec: export(spec),
+                [f'load:{name}'] + ([f'export:{spec.partition_join.source}'] if spec.partition_join is not None else [])
+            )
+
+    # Surrogate links grouped by the table they point to, foreign_table not defined is the same table
+    links = {}
+    for spec in specs:
+        if spec.load:
+            for surrogate in spec.surrogates:
+                links.setdefault(surrogate.get('foreign_table', spec.table_name), []).append({'table': spec.table_name, **surrogate})
+    for foreign_table, surrogates in links.items():
+        tables = {surrogate['table'] for surrogate in surrogates} | {foreign_table}
+        tasks[f'surrogates:{foreign_table}'] = (
+            lambda results, surrogates=surrogates: resolve(surrogates),
+            [f'load:{table}' for table in sorted(tables)]
+        )
+
+    for summary in aggregates:
+        tasks[f'aggregate:{summary.table_name}'] = (
+            lambda results, summary=summary: aggregate(summary),
+            [f'load:{table}' for table in summary.tables]
+        )
+    return tasks
+
+"""
+Runs a DAG of tasks on a worker pool
+- tasks maps a name to (function, dependencies)
+- A task starts as soon as all of its dependencies finished
+- The first failing task stops the run and re-raises its error
+"""
+def runDag(tasks, max_workers=4):
+    for name, (_, dependencies) in tasks.items():
+        missing = [dependency for dependency in dependencies if dependency not in tasks]
+        if missing:
+            raise KeyError(f"{name} depends on unknown tasks {missing}")
+
+    start = time.perf_counter()
+    results = {}
+    pending = dict(tasks)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for name, (fn, dependencies) in list(pending.items()):
+                if all(dependency in results for dependency in dependencies):
+                    running[pool.submit(fn, results)] = name
+                    del pending[name]
+
+            if not running:
+                raise ValueError(f"Circular dependencies between {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                logger.info(f"Finished {name} after {time.perf_counter() - start:.2f}s")
+
+    return results
@@ -0,0 +1,104 @@
+import json
+import os
+from dataclasses import dataclass
+
+RENAMES_PATH = 'renames.json'
+
+"""
+SQL Server type per column type (COLUMN_NAME_type)
+"""
+SQL_TYPES = {
+    'name': 'NVARCHAR(80)',
+    'image': 'NVARCHAR(60)',
+    'id': 'INT',
+    'description': 'NVARCHAR(MAX)',
+    'money': 'DECIMAL(19,4)',
+    'percentage': 'DECIMAL(12,12)',
+    'date': 'DATE',
+    'code': 'NVARCHAR(40)',
+    'char': 'CHAR(1)',
+    'number': 'INT',
+    'phone': 'NVARCHAR(30)',
+    'address': 'NVARCHAR(80)',
+    'bool': 'BIT',
+}
+
+"""
+Compact pandas dtype per column type (COLUMN_NAME_type)
+- category is only used for columns with few distinct values
+- decimal stores exact fixed-point values with the precision and scale of the SQL type (dtypes.MONEY_DTYPE)
+"""
+PANDAS_DTYPES = {
+    'name': 'category',
+    'image': 'object',
+    'id': 'Int32',
+    'description': 'object',
+    'money': 'decimal',
+    'percentage': 'float64',
+    'date': 'datetime64[ns]',
+    'code': 'category',
+    'char': 'category',
+    'number': 'Int32',
+    'phone': 'object',
+    'address': 'object',
+    'bool': 'boolean',
+}
+
+@dataclass
+class Schema:
+    renames: dict
+    """Original column name to Data Warehouse column name"""
+    valid_columns: set
+    """All vetted Data Warehouse columns"""
+    types: dict
+    """Column type (suffix) per Data Warehouse column"""
+    sql_types: dict
+    """SQL Server type per Data Warehouse column"""
+    pandas_dtypes: dict
+    """pandas dtype per Data Warehouse column"""
+
+"""
+Gets the column type of a column name (COLUMN_NAME_type)
+- Column names without a type are invalid
+"""
+def typeSuffix(column_name):
+    try:
+        return column_name.rsplit('_', 1)[1]
+    except IndexError:
+        raise ValueError(f"Column name {column_name} doesn't contain a type")
+
+"""
+Loads and validates the rename mapping and derives the lookups of every column
+"""
+def loadSchema(path=RENAMES_PATH):
+    with open(path) as f_in:
+        renames = json.load(f_in)
+
+    valid_columns = set(renames.values())
+    types = {column: typeSuffix(column) for column in valid_columns}
+
+    unknown = sorted(column for column, column_type in types.items() if column_type not in SQL_TYPES)
+    if unknown:
+        raise ValueError(f"Column type not found for {', '.join(unknown)} in {path}")
+
+    return Schema(
+        renames=renames,
+        valid_columns=valid_columns,
+        types=types,
+        sql_types={column: SQL_TYPES[column_type] for column, column_type in types.items()},
+        pandas_dtypes={column: PANDAS_DTYPES[column_type] for column, column_type in types.items()},
+    )
+
+_cache = {}
+
+"""
+Gets the schema of the rename mapping, loaded once per process
+- The cache is invalidated when the file is modified
+"""
+def getSchema(path=RENAMES_PATH):
+    mtime = os.stat(path).st_mtime_ns
+    cached = _cache.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, loadSchema(path))
+        _cache[path] = cached
+    return cached[1]
@@ -12,3 +12,39 @@ class Settings:
     """Directory containing data to extract"""
     log_dir: Path
     """Directory for logs"""
+    batch_size: int = 1000
+    """Number of rows sent per executemany batch when bulk inserting"""
+    max_workers: int = 4
+    """Maximum number of worker threads used for concurrent stages"""
+    insert_partitions: int = 1
+    """Number of connections every chunk of a large table (TableSpec.stream) is inserted over at once"""
+    insert_retries: int = 3
+    """Number of times a failed batch of a partitioned insert is retried"""
+    incremental: bool = False
+    """Only load new or changed rows into the existing tables instead of a full reload"""
+    disable_indexes: bool = False
+    """Disable the indexes of a table during an incremental load and rebuild them afterwards"""
+    chunk_size: int = None
+    """Stream large tables (TableSpec.stream) in chunks of this many rows, None extracts them whole"""
+    target: str = 'sqlserver'
+    """Data Warehouse backend to load into (targets.TARGETS): sqlserver or sqlite"""
+    target_path: Path = None
+    """Database file of file based targets (sqlite)"""
+    pool_size: int = 4
+    """Maximum number of pooled connections to the Data Warehouse"""
+    cache_dir: Path = None
+    """Directory of the extraction cache (cache.py), None always extracts from the sources"""
+    cache_size: int = 2**30
+    """Maximum size of the extraction cache in bytes, least recently used tables are evicted first"""
+    validate: bool = True
+    """Validate every staged table (validation.py) before anything is loaded"""
+    profile_types: bool = True
+    """Right-size the SQL types of new tables from their staged data (profiling.py), streamed tables keep their column types"""
+    checkpoint_dir: Path = None
+    """Directory of the run manifest and staged tables (checkpoint.py), None doesn't checkpoint"""
+    resume: bool = False
+    """Continue the interrupted run in checkpoint_dir instead of starting over"""
+    export_dir: Path = None
+    """Directory of the Parquet export of every loaded table (export.py), None doesn't export"""
+    pushdown: bool = False
+    """Run the joins and projections of SQLite only tables inside SQLite (pushdown.py) instead of pandas"""
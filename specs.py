@@ -0,0 +1,353 @@
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Callable
+from schema import getSchema
+from tableutils import mergeTables, filterColumns, excludeColumns, sizeCheck
+from dtypes import castTypes
+from dates import addDateKeys
+from catalog import mergeCopies
+from instrumentation import measure, frameBytes
+
+@dataclass
+class Join:
+    source: str
+    """Registry name of the table to merge with"""
+    on: str
+    """Column to merge on"""
+    rename: dict = field(default_factory=dict)
+    """Columns to rename right after this merge"""
+    exclude: list = field(default_factory=list)
+    """Columns to drop right after this merge"""
+
+@dataclass
+class Derive:
+    column: str
+    """Name of the new (original, not yet renamed) column"""
+    inputs: list
+    """Columns the new column is computed from"""
+    fn: Callable[[pd.DataFrame], pd.Series]
+    """Computes the new column from the merged dataframe"""
+
+@dataclass
+class Index:
+    columns: list = field(default_factory=list)
+    """Indexed columns in order, 'Timestamp DESC' sorts descending"""
+    columnstore: bool = False
+    """Clustered columnstore index storing the whole table (fact tables), without columns"""
+    where: str = None
+    """Filter of a filtered index, e.g. 'IsCurrent = 1'"""
+    include: list = field(default_factory=list)
+    """Columns stored in the index without being sorted on, so lookups reading them don't go back to the table"""
+
+"""
+Clustered columnstore of fact tables, scanned by the dashboards
+"""
+COLUMNSTORE = Index(columnstore=True)
+
+@dataclass
+class TableSpec:
+    table_name: str
+    """Name of the table in the Data Warehouse"""
+    source: str
+    """Registry name of the main source table"""
+    width: int
+    """Expected number of columns after filtering"""
+    PK: str = None
+    """Natural key, None uses the first column and SK_<table_name>"""
+    SK_columns: list = field(default_factory=list)
+    """Columns that get an SK_ column linking to another table"""
+    surrogates: list = field(default_factory=list)
+    """Surrogate links (column, foreign_table, foreign_column) resolved after loading"""
+    joins: list = field(default_factory=list)
+    """Tables to merge with, in order"""
+    derived: list = field(default_factory=list)
+    """Columns computed after merging"""
+    drop: list = field(default_factory=list)
+    """Source columns to drop before merging"""
+    renames: dict = field(default_factory=dict)
+    """Renames on top of renames.json"""
+    exclude: list = field(default_factory=list)
+    """Renamed columns to drop before filtering"""
+    load: bool = True
+    """Whether the table is loaded into the Data Warehouse"""
+    stream: bool = False
+    """Whether the source is large enough to be streamed in chunks when chunk_size is set"""
+    indexes: list = None
+    """Indexes built after loading, None only indexes the natural key and Timestamp (tableIndexes)"""
+    types: dict = field(default_factory=dict)
+    """SQL types that override the profiled type of a column (profiling.tableTypes)"""
+    history: bool = False
+    """Type 2 slowly changing dimension, changed rows close their previous version (ValidFrom, ValidTo, IsCurrent)"""
+    partition: str = None
+    """Date column (_date) or YEAR_number column the Parquet export is partitioned by month on (export.py), None exports a single file"""
+    partition_join: Join = None
+    """Exported table and shared column the partition column is looked up from, for tables without a date of their own"""
+
+"""
+Duplicate source tables merged into a single table before transforming
+- name, first table, second table, index column, renames of the first table
+"""
+RECONCILED = [
+    ('retailer_site', 'sales.retailer_site', 'crm.retailer_site', 'RETAILER_SITE_CODE', {}),
+    # Column name mismatch
+    ('country', 'sales.country', 'crm.country', 'COUNTRY_CODE', {'COUNTRY': 'COUNTRY_EN'}),
+]
+
+full_name = Derive('FULL_NAME', ['FIRST_NAME', 'LAST_NAME'], lambda df: df['FIRST_NAME'] + ' ' + df['LAST_NAME'])
+
+SPECS = [
+    TableSpec(
+        table_name='Product',
+        source='sales.product',
+        joins=[
+            Join('sales.product_type', 'PRODUCT_TYPE_CODE'),
+            Join('sales.product_line', 'PRODUCT_LINE_CODE'),
+        ],
+        width=10,
+        PK='PRODUCT_id',
+        history=True,
+    ),
+    TableSpec(
+        table_name='Sales_Staff',
+        # sales_staff and sales_branch also exist in go_sales, identical copies are read once and differing ones merged (catalog.py)
+        source='staff.sales_staff',
+        joins=[
+            Join('staff.sales_branch', 'SALES_BRANCH_CODE'),
+            Join('country', 'COUNTRY_CODE'),
+            Join('crm.sales_territory', 'SALES_TERRITORY_CODE'),
+        ],
+        derived=[full_name],
+        width=24,
+        PK='SALES_STAFF_id',
+        SK_columns=['MANAGER_id'],
+        surrogates=[{'column': 'MANAGER_id', 'foreign_column': 'SALES_STAFF_id'}],
+        history=True,
+    ),
+    TableSpec(
+        table_name='Satisfaction_Type',
+        source='staff.satisfaction_type',
+        width=2,
+        PK='SATISFACTION_TYPE_id',
+    ),
+    TableSpec(
+        table_name='Course',
+        source='staff.course',
+        width=2,
+        PK='COURSE_id',
+    ),
+    TableSpec(
+        table_name='Sales_Forecast',
+        source='csv.sales_forecast',
+        width=4,
+        # PRODUCT_id isn't unique and is linked to Product
+        PK=None,
+        SK_columns=['PRODUCT_id'],
+        surrogates=[{'column': 'PRODUCT_id', 'foreign_table': 'Product'}],
+        indexes=[COLUMNSTORE],
+    ),
+    TableSpec(
+        table_name='Inventory_Level',
+        source='csv.inventory_level',
+        width=4,
+        # PRODUCT_id isn't unique and is linked to Product
+        PK=None,
+        SK_columns=['PRODUCT_id'],
+        surrogates=[{'column': 'PRODUCT_id', 'foreign_table': 'Product'}],
+        indexes=[COLUMNSTORE],
+    ),
+    TableSpec(
+        table_name='Retailer_Contact',
+        source='crm.retailer_contact',
+        joins=[
+            Join('retailer_site', 'RETAILER_SITE_CODE'),
+            Join('country', 'COUNTRY_CODE'),
+            Join('crm.sales_territory', 'SALES_TERRITORY_CODE'),
+        ],
+        derived=[full_name],
+        width=24,
+        PK='RETAILER_CONTACT_id',
+        SK_columns=['RETAILER_id'],
+        surrogates=[{'column': 'RETAILER_id', 'foreign_table': 'Retailer'}],
+        history=True,
+    ),
+    TableSpec(
+        table_name='Retailer',
+        source='crm.retailer',
+        joins=[
+            Join('crm.retailer_headquarters', 'RETAILER_CODEMR'),
+            Join('crm.retailer_type', 'RETAILER_TYPE_CODE'),
+            # Rename language columns for clarity
+            Join('crm.retailer_segment', 'SEGMENT_CODE', rename={'LANGUAGE': 'SEGMENT_LANGUAGE_code'}),
+            # Exclude columns early due to merge naming conflicts
+            Join('country', 'COUNTRY_CODE', rename={'LANGUAGE': 'COUNTRY_LANGUAGE_code'},
+                 exclude=['TRIAL219', 'TRIAL222_x', 'TRIAL222_y', 'TRIAL222']),
+            Join('crm.sales_territory', 'SALES_TERRITORY_CODE'),
+        ],
+        width=22,
+        PK='RETAILER_id',
+        history=True,
+    ),
+    TableSpec(
+        table_name='Orders',
+        source='sales.order_header',
+        joins=[Join('sales.order_method', 'ORDER_METHOD_CODE')],
+        # RETAILER_SITE_code can be derived from RETAILER_CONTACT_id
+        # SALES_BRANCH_code can be derived from SALES_STAFF_id
+        exclude=['RETAILER_SITE_id', 'SALES_BRANCH_id'],
+        width=8,
+        PK='ORDER_TABLE_id',
+        stream=True,
+        SK_columns=['SALES_STAFF_id', 'RETAILER_CONTACT_id'],
+        surrogates=[
+            {'column': 'SALES_STAFF_id', 'foreign_table': 'Sales_Staff'},
+            {'column': 'RETAILER_CONTACT_id', 'foreign_table': 'Retailer_Contact'},
+        ],
+        indexes=[COLUMNSTORE, Index(['ORDER_TABLE_id', 'Timestamp DESC']), Index(['ORDER_DATE_id'])],
+        partition='ORDER_DATE_date',
+    ),
+    TableSpec(
+        table_name='Return_Reason',
+        source='sales.return_reason',
+        width=2,
+        PK='RETURN_REASON_id',
+    ),
+    TableSpec(
+        table_name='Training',
+        source='staff.training',
+        width=3,
+    ),
+    TableSpec(
+        table_name='Satisfaction',
+        source='staff.satisfaction',
+        width=3,
+    ),
+    TableSpec(
+        table_name='Returns',
+        source='sales.returned_item',
+        width=6,
+        PK='RETURNS_id',
+        stream=True,
+        indexes=[COLUMNSTORE, Index(['RETURNS_id', 'Timestamp DESC']), Index(['RETURN_DATE_id'])],
+        partition='RETURN_DATE_date',
+    ),
+    TableSpec(
+        table_name='Order_Details',
+        source='sales.order_details',
+        width=7,
+        PK='ORDER_DETAIL_id',
+        stream=True,
+        SK_columns=['PRODUCT_id'],
+        surrogates=[{'column': 'PRODUCT_id', 'foreign_table': 'Product'}],
+        indexes=[COLUMNSTORE, Index(['ORDER_DETAIL_id', 'Timestamp DESC'])],
+        partition='ORDER_DATE_date',
+        partition_join=Join('Orders', 'ORDER_TABLE_id'),
+    ),
+    TableSpec(
+        table_name='Sales_Target',
+        source='sales.SALES_TARGETData',
+        drop=['RETAILER_NAME'],
+        renames={'Id': 'TARGET_id'},
+        width=7,
+        PK='TARGET_id',
+        SK_columns=['SALES_STAFF_id', 'PRODUCT_id'],
+        surrogates=[
+            {'column': 'PRODUCT_id', 'foreign_table': 'Product'},
+            {'column': 'SALES_STAFF_id', 'foreign_table': 'Sales_Staff'},
+        ],
+        indexes=[COLUMNSTORE, Index(['TARGET_id', 'Timestamp DESC'])],
+        partition='YEAR_number',
+    ),
+]
+
+"""
+Date dimension generated from the range of the loaded dates (dates.dateDimension)
+"""
+DATE_SPEC = TableSpec(
+    table_name='Date',
+    source='generated.date',
+    width=9,
+    PK='DATE_id',
+)
+
+"""
+Gets the indexes of a table
+- By default (natural key, Timestamp DESC), which the latest version lookups of surrogates and incremental loads seek on
+- Tables with history also get the natural key of their current versions, filtered on IsCurrent and including RowHash (tableutils.latestVersions)
+- Tables without a natural key have no default index
+"""
+def tableIndexes(spec: TableSpec):
+    if spec.indexes is not None:
+        return spec.indexes
+    if spec.PK is None:
+        return []
+    if spec.history:
+        return [Index([spec.PK, 'Timestamp DESC']), Index([spec.PK], where='IsCurrent = 1', include=['RowHash'])]
+    return [Index([spec.PK, 'Timestamp DESC'])]
+
+"""
+Adds the merged duplicate source tables to the registry
+- duplicates are the tables found in several sources (catalog.findDuplicates)
+- Differing copies that aren't reconciled by hand are merged on their key, every copy's name then refers to the merged table
+"""
+def reconcileSources(sources, duplicates=()):
+    for name, first, second, index_col, renames in RECONCILED:
+        with measure('merge', name, len(sources[first]) + len(sources[second])) as measurement:
+            sources[name] = mergeTables(sources[first].rename(columns=renames), sources[second], index_col).reset_index()
+            measurement.rows_out = len(sources[name])
+            measurement.bytes = frameBytes(sources[name])
+
+    mergeCopies(sources, duplicates, skip={table for _, first, second, *_ in RECONCILED for table in (first, second)})
+    return sources
+
+"""
+Transforms the source tables of a spec into the table to load
+- Merge -> derive -> rename -> type -> exclude -> filter -> date keys -> assert
+"""
+def transformTable(spec: TableSpec, sources):
+    # Merge
+    with measure('merge', spec.table_name, len(sources[spec.source])) as measurement:
+        dataframe = sources[spec.source].drop(columns=spec.drop)
+        for join in spec.joins:
+            dataframe = pd.merge(dataframe, sources[join.source], on=join.on).rename(columns=join.rename)
+            if join.exclude:
+                dataframe = excludeColumns(dataframe, join.exclude)
+
+        # Add
+        for derive in spec.derived:
+            dataframe[derive.column] = derive.fn(dataframe)
+        measurement.rows_out = len(dataframe)
+
+    with measure('rename', spec.table_name, len(dataframe)) as measurement:
+        # Rename
+        dataframe = dataframe.rename(columns=getSchema().renames).rename(columns=spec.renames)
+
+        # Type
+        dataframe = castTypes(dataframe, spec.table_name)
+
+        # Exclude
+        if spec.exclude:
+            dataframe = excludeColumns(dataframe, spec.exclude)
+        dataframe = filterColumns(dataframe)
+        dataframe = addDateKeys(dataframe)
+
+        # Assert
+        sizeCheck(dataframe, spec.width)
+        measurement.rows_out = len(dataframe)
+        measurement.bytes = frameBytes(dataframe)
+    return dataframe
+
+"""
+Transforms the chunks of the main source of a spec one by one
+- Joined tables stay in memory and are merged with every chunk
+"""
+def streamTable(spec: TableSpec, sources, chunks):
+    for chunk in chunks:
+        yield transformTable(spec, {**sources, spec.source: chunk})
+
+"""
+Gets the sources that can be streamed instead of extracted
+- Sources that are merged into another table are always extracted
+"""
+def streamedSources(specs):
+    joined = {join.source for spec in specs for join in spec.joins}
+    return {spec.source for spec in specs if spec.stream} - joined
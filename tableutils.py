@@ -1,10 +1,17 @@
 import pandas as pd
 import json
 import sqlite3
-import pyodbc
 import os
 import numpy as np
+from pandas.api.extensions import take
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
 from settings import Settings
+from instrumentation import measure, frameBytes
+from csvreader import readCSV
+from schema import getSchema, SQL_TYPES
 
 """
 Establishes SQlite connection to file
@@ -13,67 +20,102 @@ def getSqlite(settings: Settings, filename):
     path = os.path.join(settings.data_dir, filename)
     return sqlite3.connect(path)
 
+"""
+Establishes SQL Server connection to the Data Warehouse
+"""
+def getSqlServer(settings: Settings):
+    import pyodbc # Only SQL Server needs an ODBC driver manager
+    return pyodbc.connect(f"DRIVER={{SQL Server}};SERVER={settings.server};DATABASE={settings.database};Trusted_Connection=yes")
+
 """
 Read data from CSV file
+- Parsed by Arrow and typed from renames.json (csvreader.py), usecols limits the columns that are read
+- Malformed rows are written to quarantine/<filename> in the log directory
+- With chunksize an iterator of dataframes of chunksize rows is returned
 """
-def getCSV(settings: Settings, filename):
+def getCSV(settings: Settings, filename, chunksize=None, usecols=None):
     path = os.path.join(settings.data_dir, filename)
-    return pd.read_csv(path)
+    return readCSV(path, chunksize, usecols, quarantine_dir=os.path.join(settings.log_dir, 'quarantine'))
+
+"""
+Raised when two tables disagree on a value while merging
+- conflicts lists every conflicting (key, column) pair
+"""
+class MergeConflictError(ValueError):
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        columns = sorted({str(column) for _, column in conflicts})
+        super().__init__(f"Merge failed due to {len(conflicts)} conflicts in columns {columns}")
+
+"""
+Takes the values of a column at row positions, -1 gives a missing value
+"""
+def alignRows(series, rows):
+    values = series.array
+    if isinstance(values, pd.arrays.NumpyExtensionArray):
+        values = values.to_numpy()
+    return take(values, rows, allow_fill=True)
 
 """
 Method to merge two tables flexibly
 - NaN values of one dataframe can be filled by the other dataframe
 - Uses all available columns
 - Errors when a row of the two dataframes doesn't match (df1 has 'A' and df2 has 'B' in row)
+- Both tables are aligned once and all common columns are compared in one vectorized pass
 """
 def mergeTables(df1, df2, index_col):
     # Ensure 'CODE' is set as the index for both DataFrames
     if index_col not in df1.columns or index_col not in df2.columns:
         raise KeyError(f"{index_col} must be a column in both DataFrames.")
-    
-    df1 = df1.set_index(index_col)
-    df2 = df2.set_index(index_col)
 
-    # Identify common and exclusive columns
-    common_columns = df1.columns.intersection(df2.columns)
-    exclusive_df1 = df1.columns.difference(df2.columns)
-    exclusive_df2 = df2.columns.difference(df1.columns)
-
-    # Concatenate exclusive columns from each DataFrame onto the other
-    df1_combined = pd.concat([df1, df2[exclusive_df2]], axis=1, sort=False)
-    df2_combined = pd.concat([df2, df1[exclusive_df1]], axis=1, sort=False)
-
-    # Resolve common columns with nulls and conflicts
-    for col in common_columns:
-        # Align the Series from both DataFrames for comparison
-        series1, series2 = df1_combined[col].align(df2_combined[col])
-
-        # Check for conflicts (non-null values that do not match)
-        conflict_mask = (~series1.isnull() & ~series2.isnull() & (series1 != series2))
-        if conflict_mask.any():
-            raise ValueError(f"Merge failed due to conflict in column '{col}'")
-
-        # Use values from df2 where df1 is null (prioritizing df1 values)
-        df1_combined[col] = series1.combine_first(series2)
+    keys1 = pd.Index(df1[index_col], name=index_col)
+    keys2 = pd.Index(df2[index_col], name=index_col)
 
-    return df1_combined
+    # Identify common and exclusive columns
+    columns1 = df1.columns.drop(index_col)
+    columns2 = df2.columns.drop(index_col)
+    common_columns = columns1.intersection(columns2)
+    exclusive_df2 = columns2.difference(columns1)
+
+    # Align once: all keys of df1 followed by the new keys of df2
+    index = keys1.append(keys2.difference(keys1, sort=False))
+    rows1 = np.concatenate([np.arange(len(keys1)), np.full(len(index) - len(keys1), -1)])
+    rows2 = keys2.get_indexer(index)
+
+    # Check for conflicts (non-null values that do not match) on the shared keys of all common columns
+    shared = rows2[:len(keys1)] >= 0
+    left = df1[common_columns].iloc[np.flatnonzero(shared)].set_axis(keys1[shared])
+    right = df2[common_columns].iloc[rows2[:len(keys1)][shared]].set_axis(keys1[shared])
+    conflict_mask = left.notna() & right.notna() & (left != right)
+    if conflict_mask.to_numpy().any():
+        conflicts = conflict_mask.stack()
+        raise MergeConflictError(conflicts[conflicts].index.tolist())
+    del left, right, conflict_mask
+
+    # Build the result column by column, without a second combined copy
+    combined = pd.DataFrame(index=index)
+    for col in columns1:
+        values = alignRows(df1[col], rows1)
+        if col in common_columns:
+            # Use values from df2 where df1 is null (prioritizing df1 values)
+            missing = pd.isna(values) & (rows2 >= 0)
+            if missing.any():
+                values = pd.Series(values).where(~missing, pd.Series(alignRows(df2[col], rows2))).array
+        combined[col] = values
+
+    # Add exclusive columns of df2
+    for col in exclusive_df2:
+        combined[col] = alignRows(df2[col], rows2)
+
+    return combined
 
 # Filters out all columns of dataframe that aren't typed
 def filterColumns(dataframe):
-    rename_mapping = {}
-
-    with open('renames.json') as f_in:
-        rename_mapping = json.load(f_in)
-
     # List of all vetted columns
-    valid_columns = set(rename_mapping.values())
-
-    valid_columns_set = set(valid_columns)
-    actual_columns_set = set(dataframe.columns)
-    intersection_columns = list(actual_columns_set.intersection(valid_columns_set))
+    valid_columns = getSchema().valid_columns
 
-    # Use the intersection result to filter columns from dataframe
-    return dataframe[intersection_columns]
+    # Keep the column order of the dataframe
+    return dataframe[[column for column in dataframe.columns if column in valid_columns]]
 
 # Filters out all columns of dataframe that aren't typed
 def excludeColumns(dataframe, column_names):
@@ -88,15 +130,7 @@ def sizeCheck(dataframe, expected_column_count):
 Get the last slice of a string
 """
 def getTypes():
-    rename_mapping = {}
-    with open('renames.json') as f_in:
-        rename_mapping = json.load(f_in)
-
-    types = {}
-    for column in rename_mapping.values():
-        column_type = column.rsplit('_', 1)[1]
-        types[column_type] = ''
-    return types
+    return {column_type: '' for column_type in getSchema().types.values()}
 
 """
 Uses the column name to derive a SQL Server compatible type
@@ -104,25 +138,14 @@ Uses the column name to derive a SQL Server compatible type
 - Column names without a type are invalid
 """
 def columnType(column_name):
-    column_types = {
-        'name': 'NVARCHAR(80)',
-        'image': 'NVARCHAR(60)',
-        'id': 'INT',
-        'description': 'NTEXT',
-        'money': 'DECIMAL(19,4)',
-        'percentage': 'DECIMAL(12,12)',
-        'date': 'NVARCHAR(30)',
-        'code': 'NVARCHAR(40)',
-        'char': 'CHAR(1)',
-        'number': 'INT',
-        'phone': 'NVARCHAR(30)',
-        'address': 'NVARCHAR(80)',
-        'bool': 'BIT',
-    }
+    try:
+        return getSchema().sql_types[column_name]
+    except KeyError: # Not a renamed column, derive from its name
+        pass
 
     err = ''
     try:
-        return column_types[column_name.rsplit('_', 1)[1]]
+        return SQL_TYPES[column_name.rsplit('_', 1)[1]]
     except IndexError:
         err = "Column name doesn't contain a type"
     except KeyError:
@@ -132,140 +155,153 @@ def columnType(column_name):
 """
 Method to drop multiple tables from a list
 """
-def dropTables(tables, cursor):
-    for table in tables:
-        table_name = table['table_name']
-        cursor.execute(f"DROP TABLE {table_name}")
-    try:
-        cursor.commit()
-    except pyodbc.Error as e:
-        print(e)
+def dropTables(tables, target):
+    with target.cursor() as cursor:
+        for table in tables:
+            table_name = table['table_name']
+            with measure('drop', table_name):
+                cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
 
 """
 Method to insert dataframe data into SQL server
+- types maps columns to their SQL type (profiling.tableTypes), other columns get their column type
+- Tables stored as a clustered columnstore (columnstore) get a nonclustered primary key
+- Other indexes are built after loading (createIndexes)
+- Tables with history (type 2 slowly changing dimensions) get ValidFrom, ValidTo and IsCurrent, ValidTo is NULL for the current version
 """
-def createTable(tablename, dataframe, PK, SK_list, cursor):
+def createTable(tablename, dataframe, PK, SK_list, target, columnstore=False, types=None, history=False):
+    types = types or {}
     SK = ''
     columns = ''
     foreign_SQL_SK_columns = ''
     if PK == None:
         PK = dataframe.columns[0]
         SK = f'SK_{tablename}'
-        columns = f'{PK} {columnType(PK)}'
+        columns = f'{PK} {target.sqlType(types.get(PK) or columnType(PK))}'
     else:
         SK = f'SK_{PK}'
-        columns = f'{PK} {columnType(PK)} NOT NULL'
+        columns = f'{PK} {target.sqlType(types.get(PK) or columnType(PK))} NOT NULL'
+        if PK in SK_list:
+            raise ValueError(f"SK_{PK} of {tablename} can't be both its identity and a surrogate key, use PK None")
+    if history and SK == f'SK_{tablename}':
+        raise ValueError(f"{tablename} needs a natural key (PK) to keep its history")
     # Add Primary Key as third column
     
     # Add all the other columns
     for column in dataframe.columns:
         if column != PK: # PK is already added
-            columns += f', {column} {columnType(column)}'
-            if column in SK_list:
-                foreign_SQL_SK_columns += f', SK_{column} INT'
+            columns += f', {column} {target.sqlType(types.get(column) or columnType(column))}'
+        if column in SK_list:
+            foreign_SQL_SK_columns += f', SK_{column} INT'
 
-    surogate_columns = f"{SK} INT IDENTITY(1,1) NOT NULL PRIMARY KEY, Timestamp DATETIME NOT NULL DEFAULT(GETDATE())"
+    surogate_columns = f"{target.identityColumn(SK, clustered=not columnstore)}, Timestamp DATETIME NOT NULL DEFAULT({target.now}), RowHash BIGINT"
+    if history:
+        surogate_columns += f", ValidFrom DATETIME NOT NULL DEFAULT({target.now}), ValidTo DATETIME, IsCurrent BIT NOT NULL DEFAULT(1)"
 
     # Create the command
     command = f"CREATE TABLE {tablename} ({surogate_columns}, {columns+foreign_SQL_SK_columns})"
 
-    try:
-        cursor.execute(command)
-        cursor.commit()
-    except pyodbc.Error as e:
-        if 'There is already an object named' in str(e):
-            print('Table already exists in database')
+    with measure('create', tablename), target.cursor() as cursor:
+        if target.tableExists(cursor, tablename):
+            logger.info(f'Table {tablename} already exists in database')
         else:
-            raise(e)
+            cursor.execute(command)
 
 """
-Method to insert dataframe data into SQL server
+Gets the name of an index of a table
 """
-def insertTable(tablename, dataframe, PK, SK_list, cursor):
-    # Add Primary Key as first column
-    SQL_columns = ''
-    SQL_SK_columns = ''
-    if PK == None:
-        PK = dataframe.columns[0]
-        
-    SQL_columns = PK
-        
-    # Add all the other columns
-    for column in dataframe.columns:
-        # Ignore Primary Key
-        if column != PK: 
-            # Surrogate keys produce two columns
-            if column in SK_list:
-                SQL_columns    += f', {column}'
-                SQL_SK_columns += f', SK_{column}'
-            else:
-                SQL_columns    += f', {column}'
+def indexName(tablename, index):
+    if index.columnstore:
+        return f'CCI_{tablename}'
+    name = f"IX_{tablename}_{'_'.join(column.split()[0] for column in index.columns)}"
+    # Filtered indexes are named after the column they filter on
+    return f"{name}_{index.where.split()[0]}" if index.where else name
 
-    
-    # Execute inserts
-    for i, row in dataframe.iterrows():
-        values = ''
-        SK_values = ''
-        values += str(row[PK])
-
-        # Add values
-        for column in dataframe.columns:
-            if column != PK: # PK is already added
-                try:
-                    val = str(row[column]).replace("'","''")
-                    if val != 'None' and val != np.nan:
-                        values += f", '{val}'"
-                        if column in SK_list:
-                            # 0 refers to an unlinked row as placeholder
-                            SK_values += ', 0'
-                    else:
-                        values += f", NULL"
-                        if column in SK_list:
-                            # NULL refers a non-existant row
-                            SK_values += ', NULL'
-                except AttributeError:
-                    values += f", NULL"
-
-        command = f"INSERT INTO {tablename} ({SQL_columns+SQL_SK_columns}) VALUES ({values+SK_values});\n"
-        
-        cursor.execute(command)
-    
-    try:
-        cursor.commit()
-    except pyodbc.Error as e:
-        if 'There is already an object named' in str(e):
-            print('Table already exists in database')
-        else:
-            print(command)
-            print(e)
+"""
+Builds the missing indexes of a table, deferred until its rows are inserted
+- With rebuild the existing (disabled) indexes are rebuilt
+- Columnstore indexes are skipped on targets without them
+"""
+def createIndexes(tablename, indexes, target, rebuild=False):
+    with measure('index', tablename), target.cursor() as cursor:
+        for index in indexes:
+            if index.columnstore and not target.columnstore:
+                continue
+            name = indexName(tablename, index)
+            if not target.indexExists(cursor, tablename, name):
+                if index.columnstore:
+                    target.createColumnstore(cursor, tablename, name)
+                else:
+                    target.createIndex(cursor, tablename, name, index.columns, index.where, index.include)
+            elif rebuild and not index.columnstore:
+                target.rebuildIndex(cursor, tablename, name)
 
 """
-Method to update the surrogate keys of a table in SQL server
+Disables the indexes of a table before a large load, createIndexes(rebuild=True) enables them again
+- The clustered columnstore stores the table itself and stays enabled
+"""
+def disableIndexes(tablename, indexes, target):
+    with measure('index', tablename), target.cursor() as cursor:
+        for index in indexes:
+            name = indexName(tablename, index)
+            if not index.columnstore and target.indexExists(cursor, tablename, name):
+                target.disableIndex(cursor, tablename, name)
+
+"""
+Whether a table keeps the history of its rows (createTable), its current versions are marked with IsCurrent
 """
-def updateSurrogate(table, foreign_table, column, foreign_column, cursor):
+def hasHistory(cursor, tablename, target):
+    return 'IsCurrent' in target.columnTypes(cursor, tablename)
 
-    command = \
-    f"WITH CTE_MostRecent AS ( \
-            SELECT \
-                SK_{foreign_column}, \
-                {foreign_column}, \
-                ROW_NUMBER() OVER(PARTITION BY SK_{foreign_column} ORDER BY Timestamp DESC) AS rn \
-            FROM \
-                {foreign_table}  \
-        ) \
-        UPDATE t \
-        SET t.SK_{column} = f.SK_{foreign_column} \
-        FROM {table} t \
-        INNER JOIN CTE_MostRecent f ON t.{column} = f.{foreign_column} AND f.rn = 1 \
-        WHERE t.SK_{column} = 0;"
+"""
+Query of the latest version of every natural key of a table
+- Tables with history filter on IsCurrent, which seeks on their filtered index
+- Other tables rank every version by Timestamp
+- keys is a table of natural keys (Target.createKeys) the query is limited to, None selects every key
+"""
+def latestVersions(tablename, key, columns, history=False, keys=None):
+    only = f"{key} IN (SELECT {key} FROM {keys})" if keys is not None else None
+    if history:
+        return f"SELECT {columns} FROM {tablename} WHERE IsCurrent = 1" + (f" AND {only}" if only else '')
+    return f"SELECT {columns} FROM ( \
+        SELECT {columns}, ROW_NUMBER() OVER(PARTITION BY {key} ORDER BY Timestamp DESC, SK_{key} DESC) AS rn \
+        FROM {tablename}{f' WHERE {only}' if only else ''} \
+    ) ranked WHERE rn = 1"
+
+"""
+Closes the versions of a table with history that have a newer version
+- IsCurrent is cleared and ValidTo set to the ValidFrom of the next version
+- Only current versions are compared, so it also repairs a load that failed between inserting and closing
+"""
+def expireVersions(tablename, PK, target):
+    newer = f"FROM {tablename} n WHERE n.{PK} = {tablename}.{PK} AND n.SK_{PK} > {tablename}.SK_{PK}"
+    with measure('expire', tablename) as measurement, target.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {tablename} \
+            SET IsCurrent = 0, ValidTo = (SELECT MIN(n.ValidFrom) {newer}) \
+            WHERE IsCurrent = 1 AND EXISTS (SELECT 1 {newer})")
+        measurement.rows_out = cursor.rowcount
 
-    cursor.execute(command)
-    cursor.commit()
+"""
+Method to update the surrogate keys of a table in SQL server
+"""
+def updateSurrogate(table, foreign_table, column, foreign_column, target):
+    updateSurrogates([{
+        'table': table,
+        'foreign_table': foreign_table,
+        'column': column,
+        'foreign_column': foreign_column
+    }], target)
 
 """
-Method to update list of surrogate keys
+Method to update list of surrogate keys in a single pass
+- The most recent version per natural key is selected once per foreign table into an indexed temp table (latestVersions)
+- Every dependent SK column is updated from those temp tables
+- All updates are committed at once
 """
-def updateSurrogates(surrogates, cursor):
+def updateSurrogates(surrogates, target):
+    lookups = {}
+    updates = []
     for surrogate in surrogates:
         table = surrogate['table']
         column = surrogate['column']
@@ -279,4 +315,183 @@ def updateSurrogates(surrogates, cursor):
         except KeyError: # foreign_table not defined, assume same as column
             foreign_column = column
 
-        updateSurrogate(table, foreign_table, column, foreign_column, cursor)
\ No newline at end of file
+        if (foreign_table, foreign_column) not in lookups:
+            lookups[(foreign_table, foreign_column)] = target.lookupName(foreign_table, foreign_column)
+        updates.append((table, column, lookups[(foreign_table, foreign_column)], foreign_column))
+
+    tables = ', '.join(sorted({table for table, _, _, _ in updates}))
+    with measure('surrogates', tables), target.cursor() as cursor:
+        # Rank every foreign table once
+        for (foreign_table, foreign_column), lookup in lookups.items():
+            history = hasHistory(cursor, foreign_table, target)
+            target.createLookup(cursor, lookup,
+                latestVersions(foreign_table, foreign_column, f"{foreign_column}, SK_{foreign_column}", history), foreign_column)
+
+        # Apply every dependent SK column
+        for table, column, lookup, foreign_column in updates:
+            target.updateFromLookup(cursor, table, column, lookup, foreign_column)
+
+        for lookup in lookups.values():
+            target.dropLookup(cursor, lookup)
+
+"""
+Converts the rows of a dataframe into parameter tuples for executemany
+- Missing values (None/NaN/NaT) are sent as NULL
+- Dates are sent as datetime.date, the DATE columns don't store a time
+- Every SK column gets 0 for a linked value and NULL for a missing one
+"""
+def insertParameters(dataframe, columns, SK_columns):
+    values = []
+    for column in columns:
+        series = dataframe[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            series = series.dt.date
+        values.append(series.astype(object).where(series.notna(), None).tolist())
+    for column in SK_columns:
+        # 0 refers to an unlinked row as placeholder, NULL to a non-existant row
+        values.append(np.where(dataframe[column].notna(), 0, None).tolist())
+    return list(zip(*values))
+
+"""
+Gets the INSERT columns and parameter tuples of a dataframe
+- Primary Key first, then the other columns, RowHash and the surrogate key columns
+"""
+def bulkParameters(dataframe, PK, SK_list):
+    if PK == None:
+        PK = dataframe.columns[0]
+
+    # Primary Key first, surrogate key columns last
+    columns = [PK] + [column for column in dataframe.columns if column != PK]
+    SK_columns = [column for column in columns if column in SK_list]
+    SQL_columns = columns + ['RowHash'] + [f'SK_{column}' for column in SK_columns]
+
+    # Row hashes are stored so incremental loads can detect changed rows
+    parameters = insertParameters(dataframe.assign(RowHash=rowHashes(dataframe)), columns + ['RowHash'], SK_columns)
+    return SQL_columns, parameters
+
+"""
+Method to bulk insert dataframe data into SQL server
+- Sends parameterized batches of batch_size rows instead of one INSERT per row
+- SK columns get 0 as placeholder for rows with a foreign key and NULL for rows without one
+"""
+def insertTableBulk(tablename, dataframe, PK, SK_list, target, batch_size=1000, fast_executemany=True):
+    with measure('insert', tablename, len(dataframe)) as measurement:
+        SQL_columns, parameters = bulkParameters(dataframe, PK, SK_list)
+        command = f"INSERT INTO {tablename} ({', '.join(SQL_columns)}) VALUES ({', '.join(['?'] * len(SQL_columns))})"
+
+        with target.cursor() as cursor:
+            if fast_executemany:
+                target.fastExecutemany(cursor)
+            for i in range(0, len(parameters), batch_size):
+                cursor.executemany(command, parameters[i:i + batch_size])
+
+        measurement.rows_out = len(parameters)
+        measurement.bytes = frameBytes(dataframe)
+    return measurement.rows_per_second
+
+"""
+Method to insert a large dataframe over several connections at once
+- Rows are split into partitions of consecutive rows, every partition is inserted by its own worker and connection
+- Workers insert into a staging table and retry failed batches up to retries times
+- Once every partition is staged the rows are moved into the table with a single statement, so the table gets all rows or none
+  of the dataframe. Streamed tables call this per chunk, earlier chunks stay inserted when a later one fails (processing.loadTable)
+- Identities are assigned in the order of the dataframe, like insertTableBulk
+"""
+def insertTablePartitioned(tablename, dataframe, PK, SK_list, target, partitions=4, batch_size=1000, retries=3):
+    with measure('insert', tablename, len(dataframe)) as measurement:
+        SQL_columns, parameters = bulkParameters(dataframe, PK, SK_list)
+        staging = f'Staging_{tablename}'
+        staging_types = {'RowHash': 'BIGINT', **{column: 'INT' for column in SQL_columns if column.startswith('SK_')}}
+        staging_columns = ', '.join(f'{column} {target.sqlType(staging_types.get(column) or columnType(column))}' for column in SQL_columns)
+        command = f"INSERT INTO {staging} (RowNumber, {', '.join(SQL_columns)}) VALUES ({', '.join(['?'] * (len(SQL_columns) + 1))})"
+
+        dropTables([{'table_name': staging}], target)
+        with target.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {staging} (RowNumber BIGINT NOT NULL, {staging_columns})")
+
+        failed = threading.Event()
+
+        def insertPartition(rows):
+            for start in range(rows.start, rows.stop, batch_size):
+                if failed.is_set():
+                    return
+                batch = [(row,) + parameters[row] for row in range(start, min(start + batch_size, rows.stop))]
+                for attempt in range(retries + 1):
+                    try:
+                        with target.cursor() as cursor:
+                            target.fastExecutemany(cursor)
+                            cursor.executemany(command, batch)
+                        break
+                    except target.Error as e:
+                        if attempt == retries:
+                            failed.set()
+                            raise
+                        logger.warning(f"Retrying batch {start} of {tablename} ({e})")
+                        time.sleep(0.1 * 2 ** attempt)
+
+        try:
+            bounds = np.linspace(0, len(parameters), partitions + 1).astype(int)
+            with ThreadPoolExecutor(max_workers=partitions) as pool:
+                futures = [pool.submit(insertPartition, range(bounds[i], bounds[i + 1])) for i in range(partitions)]
+                for future in futures:
+                    future.result()
+
+            with target.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {tablename} ({', '.join(SQL_columns)}) \
+                    SELECT {', '.join(SQL_columns)} FROM {staging} ORDER BY RowNumber")
+        finally:
+            dropTables([{'table_name': staging}], target)
+
+        measurement.rows_out = len(parameters)
+        measurement.bytes = frameBytes(dataframe)
+    return measurement.rows_per_second
+
+"""
+Hashes every row of a dataframe into a signed 64 bit integer (BIGINT)
+- Columns are sorted and values hashed as strings, so the hash doesn't depend on column order or dtypes
+"""
+def rowHashes(dataframe):
+    values = dataframe[sorted(dataframe.columns)].astype(str)
+    return pd.Series(pd.util.hash_pandas_object(values, index=False).values.view(np.int64), index=dataframe.index)
+
+"""
+Method to insert only the new or changed rows of a dataframe as new versions
+- Row hashes are compared against the most recent version of the natural keys (PK) of the dataframe
+- Those keys are staged in a temp table the lookup joins on, so each chunk of a streamed table only reads its own keys
+- Tables without a unique PK are compared on the row hash alone
+- Tables with history close the versions the new rows replace (expireVersions)
+- Returns the inserted rows
+"""
+def insertChanges(tablename, dataframe, PK, SK_list, target, batch_size=1000):
+    with measure('compare', tablename, len(dataframe)) as measurement, target.cursor() as cursor:
+        hashes = rowHashes(dataframe)
+        history = hasHistory(cursor, tablename, target)
+        if PK == None or dataframe[PK].duplicated().any():
+            cursor.execute(f"SELECT DISTINCT RowHash FROM {tablename}")
+            known_hashes = {row[0] for row in cursor.fetchall()}
+            changed = ~hashes.isin(known_hashes)
+        else:
+            keys = target.keysName(tablename)
+            target.createKeys(cursor, keys, PK, target.columnTypes(cursor, tablename)[PK])
+            try:
+                target.fastExecutemany(cursor)
+                values = [(key,) for key in dataframe[PK].tolist()]
+                for start in range(0, len(values), batch_size):
+                    cursor.executemany(f"INSERT INTO {keys} ({PK}) VALUES (?)", values[start:start + batch_size])
+                cursor.execute(latestVersions(tablename, PK, f"{PK}, RowHash", history, keys))
+                latest_versions = [(str(key), row_hash) for key, row_hash in cursor.fetchall()]
+            finally:
+                target.dropLookup(cursor, keys)
+            # A row is unchanged when its (key, hash) pair is the latest version of that key
+            versions = pd.MultiIndex.from_arrays([dataframe[PK].astype(str), hashes])
+            changed = ~versions.isin(latest_versions)
+        changes = dataframe[changed]
+        measurement.rows_out = len(changes)
+
+    logger.info(f"{len(changes)} of {len(dataframe)} rows in {tablename} are new or changed")
+    if len(changes) > 0:
+        insertTableBulk(tablename, changes, PK, SK_list, target, batch_size)
+    if history:
+        expireVersions(tablename, PK, target)
+    return changes
\ No newline at end of file
@@ -0,0 +1,302 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+import numpy as np
+from settings import Settings
+from tableutils import getSqlServer
+
+"""
+Keeps warm connections around so parallel loaders can reuse them
+- At most size connections are handed out at the same time, other callers wait
+- Connections are opened lazily and returned to the pool after use
+"""
+class ConnectionPool:
+    def __init__(self, connect, size=4):
+        self.connect = connect
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        with self.slots:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                connection = self.connect()
+            try:
+                yield connection
+            except BaseException:
+                # A failed connection may be unusable, don't hand it out again
+                connection.close()
+                raise
+            self.idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+"""
+Data Warehouse backend the tableutils helpers load into
+- Hands out pooled cursors that commit on success and roll back on errors
+- Subclasses provide the connection and the dialect specific SQL (identity, timestamp, indexes and surrogate lookups)
+"""
+class Target:
+    Error = Exception
+    """Error raised by the database driver"""
+    now = ''
+    """SQL expression of the current timestamp"""
+    columnstore = False
+    """Whether the backend supports clustered columnstore indexes"""
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.pool = ConnectionPool(self.connect, settings.pool_size)
+
+    def connect(self):
+        raise NotImplementedError
+
+    """
+    Cursor on a pooled connection, committed when the block succeeds
+    """
+    @contextmanager
+    def cursor(self):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def close(self):
+        self.pool.close()
+
+    def identityColumn(self, name, clustered=True):
+        raise NotImplementedError
+
+    """
+    Spells a SQL Server column type in the dialect of the backend
+    """
+    def sqlType(self, sql_type):
+        return sql_type
+
+    def tableExists(self, cursor, table):
+        raise NotImplementedError
+
+    def indexExists(self, cursor, table, name):
+        raise NotImplementedError
+
+    def columnTypes(self, cursor, table):
+        raise NotImplementedError
+
+    def createIndex(self, cursor, table, name, columns, where=None, include=()):
+        cursor.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"
+                       + (f" INCLUDE ({', '.join(include)})" if include else '')
+                       + (f" WHERE {where}" if where else ''))
+
+    def createColumnstore(self, cursor, table, name):
+        raise NotImplementedError
+
+    def disableIndex(self, cursor, table, name):
+        raise NotImplementedError
+
+    def rebuildIndex(self, cursor, table, name):
+        raise NotImplementedError
+
+    def fastExecutemany(self, cursor):
+        pass
+
+    def lookupName(self, foreign_table, foreign_column):
+        return f'Latest_{foreign_table}_{foreign_column}'
+
+    def createLookup(self, cursor, lookup, select, foreign_column):
+        raise NotImplementedError
+
+    def updateFromLookup(self, cursor, table, column, lookup, foreign_column):
+        raise NotImplementedError
+
+    def dropLookup(self, cursor, lookup):
+        cursor.execute(f"DROP TABLE {lookup}")
+
+    def keysName(self, table):
+        return f'Keys_{table}'
+
+    """
+    Creates a temp table of natural keys, which lookups of the latest versions of some keys join on (latestVersions)
+    """
+    def createKeys(self, cursor, keys, column, sql_type):
+        raise NotImplementedError
+
+"""
+SQL Server Data Warehouse (pyodbc)
+- pyodbc is imported when the target is built, so the other targets run without an ODBC driver manager
+"""
+class SQLServerTarget(Target):
+    now = 'GETDATE()'
+    columnstore = True
+
+    def __init__(self, settings: Settings):
+        import pyodbc
+        self.Error = pyodbc.Error
+        super().__init__(settings)
+
+    def connect(self):
+        return getSqlServer(self.settings)
+
+    def identityColumn(self, name, clustered=True):
+        # A table stored as a clustered columnstore can't also be clustered on its key
+        return f"{name} INT IDENTITY(1,1) NOT NULL PRIMARY KEY {'CLUSTERED' if clustered else 'NONCLUSTERED'}"
+
+    def tableExists(self, cursor, table):
+        cursor.execute("SELECT OBJECT_ID(?, 'U')", table)
+        return cursor.fetchone()[0] is not None
+
+    def indexExists(self, cursor, table, name):
+        cursor.execute("SELECT 1 FROM sys.indexes WHERE object_id = OBJECT_ID(?) AND name = ?", table, name)
+        return cursor.fetchone() is not None
+
+    def columnTypes(self, cursor, table):
+        cursor.execute(
+            "SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, NUMERIC_PRECISION, NUMERIC_SCALE \
+            FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = ?", table)
+        types = {}
+        for column, data_type, length, precision, scale in cursor.fetchall():
+            data_type = data_type.upper()
+            if data_type in ('CHAR', 'NCHAR', 'VARCHAR', 'NVARCHAR'):
+                data_type = f"{data_type}({'MAX' if length == -1 else length})"
+            elif data_type == 'DECIMAL':
+                data_type = f'DECIMAL({precision},{scale})'
+            types[column] = data_type
+        return types
+
+    def createColumnstore(self, cursor, table, name):
+        cursor.execute(f"CREATE CLUSTERED COLUMNSTORE INDEX {name} ON {table}")
+
+    def disableIndex(self, cursor, table, name):
+        cursor.execute(f"ALTER INDEX {name} ON {table} DISABLE")
+
+    def rebuildIndex(self, cursor, table, name):
+        cursor.execute(f"ALTER INDEX {name} ON {table} REBUILD")
+
+    def fastExecutemany(self, cursor):
+        cursor.fast_executemany = True
+
+    def lookupName(self, foreign_table, foreign_column):
+        return f'#Latest_{foreign_table}_{foreign_column}'
+
+    def keysName(self, table):
+        return f'#Keys_{table}'
+
+    def createKeys(self, cursor, keys, column, sql_type):
+        cursor.execute(f"CREATE TABLE {keys} ({column} {sql_type} NOT NULL PRIMARY KEY)")
+
+    def createLookup(self, cursor, lookup, select, foreign_column):
+        cursor.execute(
+            f"SELECT * INTO {lookup} FROM ({select}) ranked; \
+            CREATE UNIQUE CLUSTERED INDEX IX_{lookup[1:]} ON {lookup} ({foreign_column});")
+
+    def updateFromLookup(self, cursor, table, column, lookup, foreign_column):
+        cursor.execute(
+            f"UPDATE t \
+            SET t.SK_{column} = f.SK_{foreign_column} \
+            FROM {table} t \
+            INNER JOIN {lookup} f ON t.{column} = f.{foreign_column} \
+            WHERE t.SK_{column} = 0;")
+
+"""
+Local file based Data Warehouse (sqlite3)
+- Same identity, timestamp and surrogate semantics as SQL Server, for machines without SQL Server
+- Stored in settings.target_path, WAL mode lets loaders read while another one writes
+"""
+class SQLiteTarget(Target):
+    Error = sqlite3.Error
+    now = 'CURRENT_TIMESTAMP'
+
+    def connect(self):
+        # Pooled connections move between threads, but are only used by one at a time
+        connection = sqlite3.connect(self.settings.target_path, timeout=60, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def identityColumn(self, name, clustered=True):
+        return f"{name} INTEGER PRIMARY KEY AUTOINCREMENT"
+
+    # SQLite only takes numeric lengths, its text columns have no limit anyway
+    def sqlType(self, sql_type):
+        return sql_type.replace('(MAX)', '')
+
+    def tableExists(self, cursor, table):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+        return cursor.fetchone() is not None
+
+    def indexExists(self, cursor, table, name):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND tbl_name=? AND name=?", (table, name))
+        return cursor.fetchone() is not None
+
+    # SQLite has no INCLUDE, included columns trail the key columns so the index still covers them
+    # It only covers the query of a filtered index that holds the filtered column as well
+    def createIndex(self, cursor, table, name, columns, where=None, include=()):
+        filtered = [where.split()[0]] if where and include else []
+        super().createIndex(cursor, table, name, [*columns, *include, *filtered], where)
+
+    # Declared types, SQLite doesn't enforce them
+    def columnTypes(self, cursor, table):
+        cursor.execute(f'PRAGMA table_info("{table}")')
+        return {row[1]: row[2] for row in cursor.fetchall()}
+
+    # SQLite can't disable an index, it's dropped and created again after the load
+    def disableIndex(self, cursor, table, name):
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+    def rebuildIndex(self, cursor, table, name):
+        cursor.execute(f"REINDEX {name}")
+
+    def createKeys(self, cursor, keys, column, sql_type):
+        cursor.execute(f"CREATE TEMP TABLE {keys} ({column} {sql_type} NOT NULL PRIMARY KEY)")
+
+    def createLookup(self, cursor, lookup, select, foreign_column):
+        cursor.execute(f"CREATE TEMP TABLE {lookup} AS {select}")
+        cursor.execute(f"CREATE UNIQUE INDEX temp.IX_{lookup} ON {lookup} ({foreign_column})")
+
+    def updateFromLookup(self, cursor, table, column, lookup, foreign_column):
+        cursor.execute(
+            f"UPDATE {table} AS t \
+            SET SK_{column} = f.SK_{foreign_column} \
+            FROM {lookup} AS f \
+            WHERE t.{column} = f.{foreign_column} AND t.SK_{column} = 0;")
+
+# sqlite3 only binds builtin types
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, datetime.isoformat)
+sqlite3.register_adapter(np.int32, int)
+sqlite3.register_adapter(np.int64, int)
+sqlite3.register_adapter(np.float64, float)
+sqlite3.register_adapter(np.bool_, bool)
+
+"""
+Available targets by Settings.target
+"""
+TARGETS = {
+    'sqlserver': SQLServerTarget,
+    'sqlite': SQLiteTarget,
+}
+
+"""
+Builds the Data Warehouse target configured in settings
+"""
+def getTarget(settings: Settings):
+    try:
+        target = TARGETS[settings.target]
+    except KeyError:
+        raise ValueError(f"Unknown target {settings.target}, expected one of {', '.join(TARGETS)}")
+    return target(settings)
@@ -1,6 +1,27 @@
 from tableutils import * 
+from scheduler import buildTasks, runDag
+from dtypes import castColumn, LossyCastError, MONEY_DTYPE
+from targets import getTarget
+from instrumentation import Measurement, measure, summarize, finishRun
+from cache import ExtractCache
+from specs import SPECS, TableSpec, Join, Index, COLUMNSTORE
+from pushdown import readPushed
+from csvreader import readCSV
+from validation import validateTables, validateChunks, ValidationError
+from aggregates import AGGREGATES, currentTimestamp, refreshAggregate
+from dates import addDateKeys, dateDimension
+from profiling import tableTypes
+from checkpoint import RunManifest, checkpointTasks
+from export import ParquetExport
+from catalog import findDuplicates, requiredCopies, sourceAliases, mergeCopies
+from extract import extractSources
+from processing import loadTable
+import sqlite3
 import pandas as pd
 import numpy as np
+import os
+import tempfile
+from contextlib import contextmanager
 
 
 def mergeTest():
@@ -52,7 +73,10 @@ def mergeConflictTest():
     
     try:
         mergeTables(df1,df2,'CODE')
-    except ValueError:
+    except MergeConflictError as e:
+        # Every conflicting key/column pair is reported
+        if e.conflicts != [('B', 'Column2'), ('C', 'Column2')]:
+            raise Exception("Merge Conflict Test Failed (conflicts)")
         print("✅ Merge Conflict Test Sucess")
         return
 
@@ -74,22 +98,646 @@ def sizeCheckTest():
 
     raise Exception("Size Check Test Failed")
 
-def surrogateTest(cursor):
+def insertParametersTest():
+    df = pd.DataFrame({
+        'CODE': [1, 2, 3],
+        'Column1': ['X', None, 'Z'],
+        'Column2': [10.5, np.nan, 30.0]
+    })
+
+    result = insertParameters(df, ['CODE', 'Column1', 'Column2'], ['Column1'])
+    expected = [
+        (1, 'X', 10.5, 0),
+        (2, None, None, None),
+        (3, 'Z', 30.0, 0)
+    ]
+
+    if result != expected:
+        raise Exception("Insert Parameters Test Failed")
+
+    print("✅ Insert Parameters Test Sucess")
+
+def rowHashesTest():
+    df = pd.DataFrame({
+        'CODE': [1, 2, 3],
+        'Column1': ['X', 'Y', 'Z']
+    })
+
+    hashes = rowHashes(df)
+    if not hashes.equals(rowHashes(df[['Column1', 'CODE']])):
+        raise Exception("Row Hashes Test Failed (column order)")
+
+    df.loc[1, 'Column1'] = 'W'
+    if (rowHashes(df) != hashes).tolist() != [False, True, False]:
+        raise Exception("Row Hashes Test Failed (change detection)")
+
+    print("✅ Row Hashes Test Sucess")
+
+def runDagTest():
+    order = []
+    tasks = {
+        'load:A': (lambda results: order.append('load:A'), []),
+        'load:B': (lambda results: order.append('load:B'), []),
+        'surrogates:A': (lambda results: order.append('surrogates:A'), ['load:A', 'load:B']),
+    }
+
+    runDag(tasks, 2)
+    if order[-1] != 'surrogates:A':
+        raise Exception("Run DAG Test Failed")
+
+    # Links to the same table are resolved by one task, after every linking table is loaded
+    specs = [
+        TableSpec(table_name='Product', source='sales.product', width=1, PK='PRODUCT_id'),
+        TableSpec(table_name='Order_Details', source='sales.order_details', width=1, PK='ORDER_DETAIL_id',
+                  surrogates=[{'column': 'PRODUCT_id', 'foreign_table': 'Product'}]),
+        TableSpec(table_name='Sales_Target', source='sales.sales_target', width=1, PK='SALES_TARGET_id',
+                  surrogates=[{'column': 'PRODUCT_id', 'foreign_table': 'Product'}]),
+    ]
+    resolved = []
+    tasks = buildTasks(specs, transform=lambda spec: [], load=lambda spec, chunks: None, resolve=resolved.append)
+    runDag(tasks, 2)
+    if [name for name in tasks if name.startswith('surrogates:')] != ['surrogates:Product'] \
+            or sorted(tasks['surrogates:Product'][1]) != ['load:Order_Details', 'load:Product', 'load:Sales_Target'] \
+            or [[surrogate['table'] for surrogate in surrogates] for surrogates in resolved] != [['Order_Details', 'Sales_Target']]:
+        raise Exception(f"Run DAG Test Failed (surrogates) {resolved}")
+
+    try:
+        runDag({'A': (lambda results: None, ['B']), 'B': (lambda results: None, ['A'])})
+    except ValueError:
+        print("✅ Run DAG Test Sucess")
+        return
+
+    raise Exception("Run DAG Test Failed (cycle)")
+
+def castColumnTest():
+    numbers = castColumn('INVENTORY_COUNT_number', pd.Series(['48', '48.0', None]), 'Int32')
+    if str(numbers.dtype) != 'Int32' or numbers.tolist()[:2] != [48, 48]:
+        raise Exception("Cast Column Test Failed")
+
+    # Money is stored fixed-point, from strings and floats alike
+    for values in [['12.34', ' 5 ', None], [12.34, 5.0, None]]:
+        money = castColumn('UNIT_PRICE_money', pd.Series(values), 'decimal')
+        if money.dtype != MONEY_DTYPE or money.astype(str).tolist()[:2] != ['12.3400', '5.0000'] or not money.isna()[2]:
+            raise Exception(f"Cast Column Test Failed (decimal) {money}")
+    for values, reason in [(['1.23456'], 'more decimals'), ([0.1 + 0.2], 'more decimals'), ([1e16], 'overflow'), (['abc'], 'not numeric')]:
+        try:
+            castColumn('UNIT_PRICE_money', pd.Series(values), 'decimal')
+            raise Exception(f"Cast Column Test Failed (lossy decimal) {values}")
+        except LossyCastError as e:
+            if reason not in str(e) or ' 0 values' in str(e):
+                raise Exception(f"Cast Column Test Failed (lossy reason) {e}")
+
+    try:
+        castColumn('INVENTORY_COUNT_number', pd.Series(['48.5']), 'Int32')
+    except LossyCastError:
+        print("✅ Cast Column Test Sucess")
+        return
+
+    raise Exception("Cast Column Test Failed (lossy)")
+
+def summarizeTest():
+    totals = summarize([
+        Measurement(stage='insert', table='Orders', seconds=1.0, rows_out=100),
+        Measurement(stage='insert', table='Orders', seconds=1.0, rows_out=300),
+        Measurement(stage='create', table='Orders', seconds=0.5),
+    ])
+
+    if [(total.stage, total.rows_out, total.rows_per_second) for total in totals] != [('insert', 400, 200.0), ('create', 0, 0.0)]:
+        raise Exception("Summarize Test Failed")
+
+    # A stage that raises is recorded as failed
+    try:
+        with measure('validate', 'SummarizeTest', 10):
+            raise ValueError("bad row")
+    except ValueError:
+        pass
+    else:
+        raise Exception("Summarize Test Failed (exception swallowed)")
+    failed = [total for total in finishRun() if total.table == 'SummarizeTest']
+    if [(total.stage, total.rows_out, total.error) for total in failed] != [('validate', 10, 'ValueError: bad row')]:
+        raise Exception("Summarize Test Failed (failed stage)")
+
+    print("✅ Summarize Test Sucess")
+
+def extractCacheTest():
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'source.csv')
+        with open(source, 'w') as f_out:
+            f_out.write('CODE,Column1\n1,X\n')
+
+        cache = ExtractCache(os.path.join(directory, 'cache'), 2**20)
+        df = pd.DataFrame({'CODE': [1, 2], 'Column1': ['X', None]})
+        key = cache.key(source, 'read_csv')
+        cache.put(key, df)
+        if not df.equals(cache.get(key)):
+            raise Exception("Extract Cache Test Failed (roundtrip)")
+
+        # A changed source gets a new key
+        with open(source, 'a') as f_out:
+            f_out.write('2,\n')
+        if cache.key(source, 'read_csv') == key:
+            raise Exception("Extract Cache Test Failed (fingerprint)")
+
+        cache.max_bytes = 0
+        cache.evict()
+        if cache.get(key) is not None:
+            raise Exception("Extract Cache Test Failed (eviction)")
+
+    print("✅ Extract Cache Test Sucess")
+
+def pushdownTest():
+    with tempfile.TemporaryDirectory() as directory:
+        for filename in ['go_sales.sqlite', 'go_staff.sqlite', 'go_crm.sqlite']:
+            sqlite3.connect(os.path.join(directory, filename)).close()
+        con = sqlite3.connect(os.path.join(directory, 'go_sales.sqlite'))
+        con.execute("CREATE TABLE product (PRODUCT_NUMBER, PRODUCT_TYPE_CODE, TRIAL1)")
+        con.execute("CREATE TABLE product_type (PRODUCT_TYPE_CODE, PRODUCT_NAME, TRIAL1)")
+        con.executemany("INSERT INTO product VALUES (?, ?, ?)", [('2', 'B', 'T'), ('1', 'A', 'T'), ('3', 'C', 'T')])
+        con.executemany("INSERT INTO product_type VALUES (?, ?, ?)", [('A', 'Tent', 'T'), ('B', 'Lamp', 'T')])
+        con.commit()
+        con.close()
+
+        settings = Settings(server='', database='', data_dir=directory, log_dir=directory)
+        spec = TableSpec('Product', 'sales.product', width=2, joins=[Join('sales.product_type', 'PRODUCT_TYPE_CODE')])
+        df = readPushed(settings, spec)
+
+    # Joined inside SQLite, unloaded columns (TRIAL1_x, TRIAL1_y, PRODUCT_TYPE_CODE) aren't read
+    expected = pd.DataFrame({'PRODUCT_NUMBER': ['2', '1'], 'PRODUCT_NAME': ['Lamp', 'Tent']})
+    if not df.equals(expected):
+        raise Exception("Pushdown Test Failed")
+
+    print("✅ Pushdown Test Sucess")
+
+def readCSVTest():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'forecast.csv')
+        with open(path, 'w') as f_out:
+            f_out.write('PRODUCT_NUMBER,EXPECTED_VOLUME\n1,10\n2,20,\n3,48.5\n4,\n')
+
+        df = readCSV(path, quarantine_dir=os.path.join(directory, 'quarantine'))
+        with open(os.path.join(directory, 'quarantine', 'forecast.csv')) as f_in:
+            quarantined = f_in.read().splitlines()
+
+    # The row with an extra field and the row with a fraction are quarantined
+    if df['PRODUCT_NUMBER'].tolist() != [1, 4] or str(df['EXPECTED_VOLUME'].dtype) != 'Int32':
+        raise Exception("Read CSV Test Failed")
+    if len(quarantined) != 2:
+        raise Exception("Read CSV Test Failed (quarantine)")
+
+    print("✅ Read CSV Test Sucess")
+
+def validateTablesTest():
+    product = TableSpec('Product', 'sales.product', width=2, PK='PRODUCT_id')
+    order_details = TableSpec('Order_Details', 'sales.order_details', width=2, PK='ORDER_DETAIL_id',
+                              surrogates=[{'column': 'PRODUCT_id', 'foreign_table': 'Product'}])
+    frames = {
+        'Product': pd.DataFrame({'PRODUCT_id': [1, 2], 'PRODUCT_name': ['Tent', 'x' * 81]}),
+        'Order_Details': pd.DataFrame({'ORDER_DETAIL_id': [1, 1, 2], 'PRODUCT_id': [1, 3, None]}),
+    }
+
+    try:
+        validateTables([product, order_details], frames)
+        raise Exception("Validate Tables Test Failed")
+    except ValidationError as e:
+        # Orphan links are only warnings
+        if [(issue.table, issue.check) for issue in e.issues] != [('Product', 'length'), ('Order_Details', 'primary_key')]:
+            raise Exception("Validate Tables Test Failed (issues)")
+
+    # Retailer joins its headquarters in the shipped go_crm.sqlite, which drops 22 retailers that 44 contacts link to
+    con = sqlite3.connect('file:data/go_crm.sqlite?mode=ro', uri=True)
+    shipped = {
+        'Retailer': pd.read_sql("SELECT RETAILER_CODE AS RETAILER_id FROM retailer JOIN retailer_headquarters USING (RETAILER_CODEMR)", con),
+        'Retailer_Contact': pd.read_sql(
+            "SELECT RETAILER_CONTACT_CODE AS RETAILER_CONTACT_id, RETAILER_CODE AS RETAILER_id FROM retailer_contact JOIN retailer_site USING (RETAILER_SITE_CODE)", con),
+    }
+    con.close()
+    specs = [spec for spec in SPECS if spec.table_name in shipped]
+    warnings = validateTables(specs, shipped)
+    if [(issue.table, issue.column, issue.check, issue.count) for issue in warnings] != [('Retailer_Contact', 'RETAILER_id', 'reference', 44)]:
+        raise Exception(f"Validate Tables Test Failed (warnings) {warnings}")
+
+    # Keys repeated in a later chunk fail, with spill before any chunk is yielded
+    chunks = validateChunks(order_details, iter([frames['Order_Details'][:1], frames['Order_Details'][1:]]), {}, spill=True)
+    try:
+        next(chunks)
+        raise Exception("Validate Tables Test Failed (chunks)")
+    except ValidationError as e:
+        if [(issue.check, issue.examples) for issue in e.issues] != [('primary_key', ['1'])]:
+            raise Exception(f"Validate Tables Test Failed (chunks) {e.issues}")
+
+    print("✅ Validate Tables Test Sucess")
+
+"""
+Temporary SQLite Data Warehouse, closed and removed after the block
+"""
+@contextmanager
+def sqliteTarget():
+    with tempfile.TemporaryDirectory() as directory:
+        settings = Settings(server='', database='', data_dir=directory, log_dir=directory,
+                            target='sqlite', target_path=os.path.join(directory, 'warehouse.sqlite'))
+        target = getTarget(settings)
+        try:
+            yield target
+        finally:
+            target.close()
+
+def sqliteTargetTest():
+    with sqliteTarget() as target:
+        df = pd.DataFrame({
+            'SALES_STAFF_id': [1, 2, 3],
+            'MANAGER_id': [None, 1, 2]
+        })
+
+        createTable('Sales_Staff', df, 'SALES_STAFF_id', ['MANAGER_id'], target)
+        insertTableBulk('Sales_Staff', df, 'SALES_STAFF_id', ['MANAGER_id'], target)
+        updateSurrogate('Sales_Staff', 'Sales_Staff', 'MANAGER_id', 'SALES_STAFF_id', target)
+
+        with target.cursor() as cursor:
+            cursor.execute("SELECT SK_SALES_STAFF_id, SK_MANAGER_id FROM Sales_Staff ORDER BY SALES_STAFF_id")
+            rows = cursor.fetchall()
+
+    if rows != [(1, None), (2, 1), (3, 2)]:
+        raise Exception("SQLite Target Test Failed")
+
+    print("✅ SQLite Target Test Sucess")
+
+def insertTablePartitionedTest():
+    with sqliteTarget() as target:
+        df = pd.DataFrame({'ORDER_DETAIL_id': range(10, 0, -1), 'QUANTITY_number': range(10)})
+
+        createTable('Order_Details', df, 'ORDER_DETAIL_id', [], target)
+        insertTablePartitioned('Order_Details', df, 'ORDER_DETAIL_id', [], target, partitions=3, batch_size=2)
 
-    updateSurrogate('Sales_Staff', 'Sales_Staff', 'MANAGER_id', 'SALES_STAFF_id', cursor)
+        # A missing key fails the final insert, none of the partitions are kept
+        try:
+            insertTablePartitioned('Order_Details', df.astype(object).where(df > 1, None), 'ORDER_DETAIL_id', [], target, partitions=3, batch_size=2)
+            raise Exception("Insert Table Partitioned Test Failed (constraint)")
+        except target.Error:
+            pass
+
+        with target.cursor() as cursor:
+            cursor.execute("SELECT ORDER_DETAIL_id FROM Order_Details ORDER BY SK_ORDER_DETAIL_id")
+            rows = [row[0] for row in cursor.fetchall()]
+
+        # Only a chunk is all or nothing, a full reload that can't be resumed drops the table a later chunk failed in
+        settings = Settings(server='', database='', data_dir='', log_dir='', insert_partitions=2)
+        spec = TableSpec(table_name='Order_Details', source='sales.order_details', width=2, PK='ORDER_DETAIL_id', stream=True)
+
+        def chunks():
+            yield df[:5]
+            raise RuntimeError('extract failed')
+
+        loaded = []
+        for resumable in (False, True):
+            try:
+                loadTable(settings, target, spec, chunks(), resumable=resumable)
+                raise Exception("Insert Table Partitioned Test Failed (chunks)")
+            except RuntimeError:
+                pass
+            with target.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'Order_Details'")
+                if cursor.fetchone()[0]:
+                    cursor.execute("SELECT COUNT(*) FROM Order_Details")
+                    loaded.append(cursor.fetchone()[0])
+                else:
+                    loaded.append(None)
+
+    if rows != list(range(10, 0, -1)):
+        raise Exception("Insert Table Partitioned Test Failed")
+    # A resumable run keeps the inserted chunk and continues after it
+    if loaded != [None, 5]:
+        raise Exception(f"Insert Table Partitioned Test Failed (resumable) {loaded}")
+
+    print("✅ Insert Table Partitioned Test Sucess")
+
+def surrogateTest(target):
+
+    updateSurrogate('Sales_Staff', 'Sales_Staff', 'MANAGER_id', 'SALES_STAFF_id', target)
 
     print("✅ Surogate Update Test Sucess")
 
 
+def refreshAggregateTest():
+    with sqliteTarget() as target:
+        product = pd.DataFrame({'PRODUCT_id': [1, 2], 'PRODUCT_LINE_id': [10, 20]})
+        details = pd.DataFrame({'ORDER_DETAIL_id': [1, 2], 'PRODUCT_id': [1, 2]})
+        returns = pd.DataFrame({
+            'RETURNS_id': [1, 2, 3],
+            'RETURN_DATE_id': [20180105, 20180217, 20180220],
+            'ORDER_DETAIL_id': [1, 1, 2],
+            'RETURN_REASON_id': [1, 1, 1],
+            'RETURN_QUANTITY_number': [5, 2, 3]
+        })
+        for table, df, PK in [('Product', product, 'PRODUCT_id'), ('Order_Details', details, 'ORDER_DETAIL_id'), ('Returns', returns, 'RETURNS_id')]:
+            createTable(table, df, PK, [], target)
+            insertTableBulk(table, df, PK, [], target)
+
+        aggregate = next(aggregate for aggregate in AGGREGATES if aggregate.table_name == 'Returns_By_Reason_Month')
+        refreshAggregate(aggregate, target)
+
+        # Mark January as already aggregated by an earlier run, it must not be recomputed
+        with target.cursor() as cursor:
+            for table in ['Product', 'Order_Details', 'Returns']:
+                cursor.execute(f"UPDATE {table} SET Timestamp = '2000-01-01 00:00:00'")
+            cursor.execute("UPDATE Returns_By_Reason_Month SET RETURNS_number = -1 WHERE MONTH_number = 201801")
+
+        # A new version of a February return replaces the old one
+        since = currentTimestamp(target)
+        insertChanges('Returns', returns.assign(RETURN_QUANTITY_number=[5, 4, 3]), 'RETURNS_id', [], target)
+        refreshAggregate(aggregate, target, since)
+
+        with target.cursor() as cursor:
+            cursor.execute("SELECT MONTH_number, PRODUCT_LINE_id, RETURNS_number, RETURN_QUANTITY_number FROM Returns_By_Reason_Month ORDER BY 1, 2")
+            rows = [tuple(row) for row in cursor.fetchall()]
+
+    if rows != [(201801, 10, -1, 5), (201802, 10, 1, 4), (201802, 20, 1, 3)]:
+        raise Exception(f"Refresh Aggregate Test Failed {rows}")
+
+    print("✅ Refresh Aggregate Test Sucess")
+
+def createIndexesTest():
+    with sqliteTarget() as target:
+        df = pd.DataFrame({'PRODUCT_id': [1, 2, 3]})
+        indexes = [COLUMNSTORE, Index(['PRODUCT_id', 'Timestamp DESC'])]
+
+        createTable('Product', df, 'PRODUCT_id', [], target, columnstore=True)
+        insertTableBulk('Product', df, 'PRODUCT_id', [], target)
+        createIndexes('Product', indexes, target)
+
+        def indexNames():
+            with target.cursor() as cursor:
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'IX_%'")
+                return [row[0] for row in cursor.fetchall()]
+
+        # SQLite has no columnstore, only the natural key is indexed
+        created = indexNames()
+        disableIndexes('Product', indexes, target)
+        disabled = indexNames()
+        createIndexes('Product', indexes, target, rebuild=True)
+        rebuilt = indexNames()
+
+    if created != ['IX_Product_PRODUCT_id_Timestamp'] or disabled != [] or rebuilt != created:
+        raise Exception(f"Create Indexes Test Failed {created} {disabled} {rebuilt}")
+
+    print("✅ Create Indexes Test Sucess")
+
+def dateDimensionTest():
+    orders = pd.DataFrame({'ORDER_DATE_date': castColumn('ORDER_DATE_date', pd.Series(['30-Dec-2018 12:00:00 AM', None, '02-Jan-2019 12:00:00 AM']), 'datetime64[ns]')})
+    orders = addDateKeys(orders)
+    if orders['ORDER_DATE_id'].tolist() != [20181230, pd.NA, 20190102]:
+        raise Exception("Date Dimension Test Failed (keys)")
+
+    try:
+        castColumn('ORDER_DATE_date', pd.Series(['30-Dec-2018 03:00:00 PM']), 'datetime64[ns]')
+        raise Exception("Date Dimension Test Failed (time of day)")
+    except LossyCastError:
+        pass
+
+    dates = dateDimension(orders['ORDER_DATE_date'].min(), orders['ORDER_DATE_date'].max())
+    if dates['DATE_id'].tolist() != [20181230, 20181231, 20190101, 20190102] or dates['QUARTER_number'].tolist() != [4, 4, 1, 1]:
+        raise Exception("Date Dimension Test Failed (dimension)")
+
+    print("✅ Date Dimension Test Sucess")
+
+def tableTypesTest():
+    spec = TableSpec(table_name='Product', source='sales.product', width=5, PK='PRODUCT_id', types={'PRODUCT_LINE_id': 'INT'})
+    df = pd.DataFrame({
+        'PRODUCT_id': pd.array([1, 300, None], dtype='Int32'),
+        'PRODUCT_name': pd.Series(['Tent', 'Crème', None], dtype='category'),
+        'PRODUCT_description': ['Two person tent', 'A' * 5000, None],
+        'PRODUCT_MARGIN_percentage': [0.25, 0.5, None],
+        'PRODUCT_LINE_id': pd.array([1, 2, 3], dtype='Int32'),
+        'PRODUCT_KIND_char': ['A', 'B', None],
+        'PRODUCT_CODE_code': ['P' * 30, 'P', None],
+        'PRODUCT_WEIGHT_number': pd.array([1, 2, 3], dtype='Int32'),
+        'PRODUCT_COST_money': [1.5, 10 ** 16, None],
+    })
+
+    types = tableTypes(spec, df, profile=True)
+    expected = {
+        'PRODUCT_id': 'INT',
+        'PRODUCT_name': 'NVARCHAR(16)',
+        'PRODUCT_description': 'VARCHAR(8000)',
+        'PRODUCT_MARGIN_percentage': 'DECIMAL(12,12)',
+        'PRODUCT_LINE_id': 'INT',
+        # Fixed lengths are kept and the power of two is capped at the declared NVARCHAR(40)
+        'PRODUCT_KIND_char': 'CHAR(1)',
+        'PRODUCT_CODE_code': 'VARCHAR(32)',
+        # Measures keep their declared types unless the values outgrow them
+        'PRODUCT_WEIGHT_number': 'INT',
+        'PRODUCT_COST_money': 'DECIMAL(28,4)',
+    }
+    if types != expected:
+        raise Exception(f"Table Types Test Failed {types}")
+
+    # Later rows have room to grow
+    validateTables([spec], {'Product': df.assign(PRODUCT_name=['Tent', 'Maximiliana', None], PRODUCT_id=pd.array([1, 2, 70000], dtype='Int32'))}, {'Product': types})
+
+    # New rows have to fit the types of the existing table
+    try:
+        validateTables([spec], {'Product': df.assign(PRODUCT_id=pd.array([1, 2, 2**31], dtype='Int64'))}, {'Product': types})
+        raise Exception("Table Types Test Failed (validation)")
+    except ValidationError as e:
+        if [issue.check for issue in e.issues] != ['range']:
+            raise Exception(f"Table Types Test Failed {e.issues}")
+
+    print("✅ Table Types Test Sucess")
+
+def catalogTest():
+    with tempfile.TemporaryDirectory() as directory:
+        for filename in ['go_sales.sqlite', 'go_staff.sqlite', 'go_crm.sqlite']:
+            sqlite3.connect(os.path.join(directory, filename)).close()
+        for filename, trial, branches, staff in [
+            ('go_sales.sqlite', 'TRIAL1', [('B1', 'Paris'), ('B2', 'Lyon')], [('S1', None), ('S2', 'b@go.com')]),
+            # Same branches in another order with another TRIAL column, one email is only known here
+            ('go_staff.sqlite', 'TRIAL2', [('B2', 'Lyon'), ('B1', 'Paris')], [('S1', 'a@go.com'), ('S2', 'b@go.com')]),
+        ]:
+            con = sqlite3.connect(os.path.join(directory, filename))
+            con.execute(f"CREATE TABLE sales_branch (SALES_BRANCH_CODE, CITY, {trial})")
+            con.execute(f"CREATE TABLE sales_staff (SALES_STAFF_CODE, EMAIL, {trial})")
+            con.executemany("INSERT INTO sales_branch VALUES (?, ?, 'T')", branches)
+            con.executemany("INSERT INTO sales_staff VALUES (?, ?, 'T')", staff)
+            con.commit()
+            con.close()
+
+        settings = Settings(server='', database='', data_dir=directory, log_dir=directory, cache_dir=os.path.join(directory, 'cache'))
+        duplicates = findDuplicates(settings)
+        aliases = sourceAliases(duplicates)
+        sources = extractSources(settings, only=requiredCopies(duplicates, {'staff.sales_branch', 'staff.sales_staff'}), aliases=aliases)
+        mergeCopies(sources, duplicates)
+
+        # Content hashes are kept until their database changes
+        stored = ExtractCache(settings.cache_dir, settings.cache_size).getDigest(
+            os.path.join(directory, 'go_staff.sqlite'), 'sales_branch\0CITY,SALES_BRANCH_CODE')
+        con = sqlite3.connect(os.path.join(directory, 'go_staff.sqlite'))
+        con.execute("UPDATE sales_branch SET CITY = 'Nice' WHERE SALES_BRANCH_CODE = 'B2'")
+        con.commit()
+        con.close()
+        changed = findDuplicates(settings)
+
+    if [(duplicate.table, duplicate.identical) for duplicate in duplicates] != [('sales_branch', True), ('sales_staff', False)]:
+        raise Exception(f"Catalog Test Failed {duplicates}")
+    # The identical copy is read once, the differing copies are merged
+    if aliases != {'staff.sales_branch': 'sales.sales_branch'} or sources['staff.sales_branch'] is not sources['sales.sales_branch']:
+        raise Exception(f"Catalog Test Failed (aliases) {aliases}")
+    if sources['staff.sales_staff']['EMAIL'].tolist() != ['a@go.com', 'b@go.com']:
+        raise Exception("Catalog Test Failed (merge)")
+    if stored is None or [duplicate.identical for duplicate in changed] != [False, False]:
+        raise Exception(f"Catalog Test Failed (stored hashes) {stored} {changed}")
+
+    print("✅ Catalog Test Sucess")
+
+def historyTest():
+    with sqliteTarget() as target:
+        products = pd.DataFrame({'PRODUCT_id': [1, 2], 'PRODUCT_name': ['Tent', 'Lamp']})
+        details = pd.DataFrame({'ORDER_DETAIL_id': [10], 'PRODUCT_id': [2]})
+
+        createTable('Product', products, 'PRODUCT_id', [], target, history=True)
+        createIndexes('Product', [Index(['PRODUCT_id'], where='IsCurrent = 1', include=['RowHash'])], target)
+        insertChanges('Product', products, 'PRODUCT_id', [], target)
+        changes = insertChanges('Product', products.assign(PRODUCT_name=['Tent', 'Lantern']), 'PRODUCT_id', [], target)
+        # A chunk only compares its own keys
+        unchanged = insertChanges('Product', products.iloc[[0]], 'PRODUCT_id', [], target)
+
+        # Rows linked after the change point to the current version
+        createTable('Order_Details', details, 'ORDER_DETAIL_id', ['PRODUCT_id'], target)
+        insertTableBulk('Order_Details', details, 'ORDER_DETAIL_id', ['PRODUCT_id'], target)
+        updateSurrogate('Order_Details', 'Product', 'PRODUCT_id', 'PRODUCT_id', target)
+
+        with target.cursor() as cursor:
+            cursor.execute("SELECT SK_PRODUCT_id, PRODUCT_id, PRODUCT_name, IsCurrent, ValidTo IS NULL FROM Product ORDER BY SK_PRODUCT_id")
+            versions = cursor.fetchall()
+            cursor.execute("SELECT SK_PRODUCT_id FROM Order_Details")
+            linked = cursor.fetchone()[0]
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='Product'")
+            indexes = [row[0] for row in cursor.fetchall()]
+            # Current versions are read from the filtered index alone
+            cursor.execute("EXPLAIN QUERY PLAN " + latestVersions('Product', 'PRODUCT_id', 'PRODUCT_id, RowHash', history=True))
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+
+    expected = [(1, 1, 'Tent', 1, 1), (2, 2, 'Lamp', 0, 0), (3, 2, 'Lantern', 1, 1)]
+    if len(changes) != 1 or len(unchanged) != 0 or versions != expected or linked != 3 or indexes != ['IX_Product_PRODUCT_id_IsCurrent']:
+        raise Exception(f"History Test Failed {versions} {linked} {indexes}")
+    if 'COVERING INDEX IX_Product_PRODUCT_id_IsCurrent' not in plan:
+        raise Exception(f"History Test Failed (plan) {plan}")
+
+    print("✅ History Test Sucess")
+
+def exportTest():
+    orders_spec = TableSpec(table_name='Orders', source='sales.order_header', width=2, PK='ORDER_TABLE_id', partition='ORDER_DATE_date')
+    details_spec = TableSpec(table_name='Order_Details', source='sales.order_details', width=3, PK='ORDER_DETAIL_id',
+                             partition='ORDER_DATE_date', partition_join=Join('Orders', 'ORDER_TABLE_id'))
+    orders = pd.DataFrame({'ORDER_TABLE_id': [1, 2, 3], 'ORDER_DATE_date': pd.to_datetime(['2019-01-05', '2019-01-20', '2019-02-01'])})
+    details = pd.DataFrame({'ORDER_DETAIL_id': [10, 11, 12], 'ORDER_TABLE_id': [1, 3, 4], 'QUANTITY_number': [5, 6, 7]})
+
+    with tempfile.TemporaryDirectory() as directory:
+        export = ParquetExport(directory)
+
+        def exportTables(orders):
+            # Chunks are staged while they're loaded
+            list(export.observe('Orders', [orders[:2], orders[2:]]))
+            list(export.observe('Order_Details', [details[:1], details[1:]]))
+            export.export(orders_spec)
+            export.export(details_spec)
+            return {path: os.stat(os.path.join(directory, 'Orders', path)).st_mtime_ns for path in export.manifest('Orders')['files']}
+
+        before = exportTables(orders)
+        # Only the partition of the changed order is rewritten
+        after = exportTables(orders.assign(ORDER_DATE_date=pd.to_datetime(['2019-01-05', '2019-01-20', '2019-02-02'])))
+
+        manifest = export.manifest('Order_Details')
+        partitions = {path: file['rows'] for path, file in manifest['files'].items()}
+        read = export.read('Orders').sort_values('ORDER_TABLE_id', ignore_index=True)
+
+    expected = {
+        'year=2019/month=01/data.parquet': 1,
+        'year=2019/month=02/data.parquet': 1,
+        'year=__HIVE_DEFAULT_PARTITION__/month=__HIVE_DEFAULT_PARTITION__/data.parquet': 1,
+    }
+    if partitions != expected or manifest['rows'] != 3:
+        raise Exception(f"Export Test Failed {partitions}")
+    if before.keys() != after.keys() or [before[path] == after[path] for path in sorted(before)] != [True, False]:
+        raise Exception(f"Export Test Failed (rewrite) {before} {after}")
+    if read['ORDER_DATE_date'].dt.day.tolist() != [5, 20, 2]:
+        raise Exception("Export Test Failed (read)")
+
+    print("✅ Export Test Sucess")
+
+def checkpointTest():
+    with tempfile.TemporaryDirectory() as directory:
+        settings = Settings(server='', database='', data_dir='data/', log_dir=directory, checkpoint_dir=directory)
+        staged = pd.DataFrame({'PRODUCT_id': pd.array([1, 2], dtype='Int32'), 'PRODUCT_name': pd.Series(['Tent', 'Lamp'], dtype='category')})
+        calls = []
+
+        def task(name, result=None, fail=False):
+            def fn(results):
+                calls.append(name)
+                if fail:
+                    raise RuntimeError(name)
+                return result
+            return fn
+
+        # The first run fails while loading
+        tasks = {
+            'transform:Product': (task('transform:Product', [staged]), []),
+            'load:Product': (task('load:Product', fail=True), ['transform:Product']),
+        }
+        try:
+            runDag(checkpointTasks(tasks, RunManifest.start(settings)), 1)
+        except RuntimeError:
+            pass
+
+        # The resumed run only loads, from the staged table
+        settings.resume = True
+        loaded = []
+        tasks = {
+            'transform:Product': (task('transform:Product', [staged]), []),
+            'load:Product': (lambda results: loaded.append(results['transform:Product'][0]), ['transform:Product']),
+        }
+        manifest = RunManifest.resume(settings)
+        runDag(checkpointTasks(tasks, manifest), 1)
+        manifest.finish()
+
+        if calls != ['transform:Product', 'load:Product'] or not loaded[0].equals(staged):
+            raise Exception(f"Checkpoint Test Failed {calls}")
+
+        # Finished runs and runs with other settings can't be resumed
+        for other in (settings, Settings(server='', database='', data_dir='other/', log_dir=directory, checkpoint_dir=directory)):
+            try:
+                RunManifest.resume(other)
+                raise Exception("Checkpoint Test Failed (resume)")
+            except ValueError:
+                pass
+
+    print("✅ Checkpoint Test Sucess")
+
 def runTests(settings):
 
-    sql_server_conn = pyodbc.connect(f"DRIVER={{SQL Server}};SERVER={settings.server};DATABASE={settings.database};Trusted_Connection=yes")
-    cursor = sql_server_conn.cursor()
+    target = getTarget(settings)
 
     mergeTest()
     mergeConflictTest()
     sizeCheckTest()
-    surrogateTest(cursor)
+    insertParametersTest()
+    rowHashesTest()
+    runDagTest()
+    castColumnTest()
+    dateDimensionTest()
+    summarizeTest()
+    extractCacheTest()
+    pushdownTest()
+    readCSVTest()
+    validateTablesTest()
+    tableTypesTest()
+    sqliteTargetTest()
+    insertTablePartitionedTest()
+    refreshAggregateTest()
+    createIndexesTest()
+    historyTest()
+    exportTest()
+    catalogTest()
+    checkpointTest()
+    surrogateTest(target)
 
 if __name__ == '__main__':
     settings = Settings(
@@ -0,0 +1,244 @@
+import os
+import re
+import tempfile
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+from loguru import logger
+from tableutils import columnType
+from profiling import tableTypes
+from instrumentation import measure
+
+"""
+Value range of the numeric SQL types
+- DECIMAL(p,s) ranges are derived from the precision and scale
+"""
+SQL_RANGES = {
+    'TINYINT': (0, 2**8 - 1),
+    'SMALLINT': (-2**15, 2**15 - 1),
+    'INT': (-2**31, 2**31 - 1),
+    'BIGINT': (-2**63, 2**63 - 1),
+    'BIT': (0, 1),
+}
+
+"""
+Severity of the checks that don't fail validation, every other check is an error
+- Orphan surrogate links keep the surrogate key 0 they're inserted with (insertParameters), no parent row updates it
+"""
+SEVERITIES = {
+    'reference': 'warning',
+}
+
+LENGTH = re.compile(r'^N?(?:VAR)?CHAR\((\d+)\)$')
+DECIMAL = re.compile(r'^DECIMAL\((\d+),(\d+)\)$')
+
+@dataclass
+class Issue:
+    table: str
+    """Data Warehouse table"""
+    column: str
+    """Column with invalid values"""
+    check: str
+    """Failed check (primary_key, not_null, length, encoding, type, range, reference)"""
+    count: int
+    """Number of invalid rows"""
+    examples: list = field(default_factory=list)
+    """Some of the invalid values"""
+    severity: str = 'error'
+    """error fails validation, warning is only logged (SEVERITIES)"""
+
+    def __str__(self):
+        return f"{self.table}.{self.column} {self.check}: {self.count} rows, e.g. {self.examples}"
+
+"""
+Raised when staged tables don't fit the Data Warehouse
+- issues lists every failed check of every table that is an error
+"""
+class ValidationError(ValueError):
+    def __init__(self, issues):
+        self.issues = issues
+        super().__init__(f"Validation failed with {len(issues)} issues:\n" + '\n'.join(str(issue) for issue in issues))
+
+def _issue(table, column, check, series, invalid):
+    examples = series[invalid].astype(str).unique()[:5].tolist()
+    return Issue(table, column, check, int(invalid.sum()), examples, SEVERITIES.get(check, 'error'))
+
+"""
+Checks the natural key is unique and never missing
+"""
+def checkPrimaryKey(table, dataframe, PK):
+    issues = []
+    keys = dataframe[PK]
+    if keys.isna().any():
+        issues.append(_issue(table, PK, 'not_null', keys, keys.isna()))
+    duplicated = keys.duplicated(keep=False) & keys.notna()
+    if duplicated.any():
+        issues.append(_issue(table, PK, 'primary_key', keys, duplicated))
+    return issues
+
+"""
+Checks the values of a column fit its SQL type, by default its column type (columnType)
+- Strings must fit the length of (N)(VAR)CHAR(n), and be ASCII only for (VAR)CHAR
+- Numbers must be numeric, whole for integers and BIT, within the range of the type and without more decimals than its scale
+"""
+def checkColumn(table, column, series, sql_type=None):
+    sql_type = sql_type or columnType(column)
+    present = series.notna()
+
+    length = LENGTH.match(sql_type)
+    if length:
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Only the distinct values have to be measured
+            strings = series.cat.categories.astype(str)
+            too_long = series.isin(series.cat.categories[strings.str.len() > int(length[1])])
+            non_ascii = series.isin(series.cat.categories[strings.str.contains(r'[^\x00-\x7f]')])
+        else:
+            strings = series.astype(str)
+            too_long = present & (strings.str.len() > int(length[1]))
+            non_ascii = present & strings.str.contains(r'[^\x00-\x7f]')
+        if too_long.any():
+            return [_issue(table, column, 'length', series, too_long)]
+        if not sql_type.startswith('N') and non_ascii.any():
+            return [_issue(table, column, 'encoding', series, non_ascii)]
+        return []
+
+    decimal = DECIMAL.match(sql_type)
+    if decimal:
+        limit = 10.0 ** (int(decimal[1]) - int(decimal[2]))
+        bounds = (-limit, limit)
+    elif sql_type in SQL_RANGES:
+        bounds = SQL_RANGES[sql_type]
+    else:
+        return []
+
+    if str(series.dtype) == 'boolean':
+        return []
+    if pd.api.types.is_numeric_dtype(series):
+        numbers = series.astype('float64')
+    else:
+        numbers = pd.to_numeric(series.astype(object).where(present, None), errors='coerce').astype('float64')
+    not_numeric = present & numbers.isna()
+    if not_numeric.any():
+        return [_issue(table, column, 'type', series, not_numeric)]
+    fractions = present & (numbers % 1 != 0)
+    if not decimal and fractions.any():
+        return [_issue(table, column, 'type', series, fractions)]
+    if decimal:
+        scale = int(decimal[2])
+        rounded = present & ((numbers - numbers.round(scale)).abs() > 10 ** -(scale + 3))
+        if rounded.any():
+            return [_issue(table, column, 'type', series, rounded)]
+
+    # DECIMAL bounds are exclusive, integer bounds inclusive
+    out_of_range = (numbers <= bounds[0]) | (numbers >= bounds[1]) if decimal else (numbers < bounds[0]) | (numbers > bounds[1])
+    return [_issue(table, column, 'range', series, out_of_range)] if out_of_range.any() else []
+
+"""
+Checks every surrogate link of a spec points to a row of its staged parent table
+- Missing values are allowed, they become NULL surrogate keys
+- Links to parents that aren't staged (streamed tables) can't be checked
+"""
+def checkReferences(spec, dataframe, frames):
+    issues = []
+    for surrogate in spec.surrogates:
+        column = surrogate['column']
+        parent = frames.get(surrogate.get('foreign_table', spec.table_name))
+        if parent is None:
+            continue
+        keys = parent[surrogate.get('foreign_column', column)].dropna().unique()
+        orphans = dataframe[column].notna() & ~dataframe[column].isin(keys)
+        if orphans.any():
+            issues.append(_issue(spec.table_name, column, 'reference', dataframe[column], orphans))
+    return issues
+
+"""
+Runs every check of a staged table in one vectorized pass over its columns
+- types maps columns to the SQL type they're loaded into, by default their column types and the overrides of the spec
+"""
+def validateTable(spec, dataframe, frames, types=None):
+    types = types or tableTypes(spec, dataframe)
+    with measure('validate', spec.table_name, len(dataframe)):
+        issues = []
+        if spec.PK is not None:
+            issues += checkPrimaryKey(spec.table_name, dataframe, spec.PK)
+        for column in dataframe.columns:
+            issues += checkColumn(spec.table_name, column, dataframe[column], types.get(column))
+        issues += checkReferences(spec, dataframe, frames)
+    return issues
+
+"""
+Logs issues and raises ValidationError when any of them is an error
+- Returns the warnings
+"""
+def reportIssues(issues):
+    errors = [issue for issue in issues if issue.severity == 'error']
+    for issue in issues:
+        (logger.error if issue.severity == 'error' else logger.warning)(str(issue))
+    if errors:
+        raise ValidationError(errors)
+    return issues
+
+"""
+Validates every staged table before anything is loaded
+- frames maps table names to staged dataframes, tables that aren't staged are skipped
+- types maps table names to the SQL types of their columns (validateTable)
+- Logs a report per table and raises ValidationError with every error, returns the warnings
+"""
+def validateTables(specs, frames, types=None):
+    types = types or {}
+    issues = []
+    for spec in specs:
+        if spec.table_name not in frames:
+            continue
+        table_issues = validateTable(spec, frames[spec.table_name], frames, types.get(spec.table_name))
+        logger.info(f"Validated {spec.table_name}: {len(frames[spec.table_name])} rows, {len(table_issues)} issues")
+        issues += table_issues
+    return reportIssues(issues)
+
+"""
+Validates the chunks of a streamed table before each one is loaded
+- Keys are also checked against the keys of the previous chunks, which are kept as a sorted array of their 64 bit hashes
+  (_keyHashes) instead of the keys themselves
+- With spill every chunk is validated before the first one is yielded, so a table isn't replaced by one that fails halfway.
+  The validated chunks wait in a temporary directory meanwhile
+"""
+def validateChunks(spec, chunks, frames, types=None, spill=False):
+    if spill:
+        yield from _spilledChunks(_validatedChunks(spec, chunks, frames, types))
+    else:
+        yield from _validatedChunks(spec, chunks, frames, types)
+
+def _validatedChunks(spec, chunks, frames, types):
+    seen = np.empty(0, dtype=np.uint64)
+    for chunk in chunks:
+        issues = validateTable(spec, chunk, frames, types)
+        if spec.PK is not None:
+            keys = chunk[spec.PK]
+            present = keys.notna().to_numpy()
+            hashes = _keyHashes(keys[present])
+            positions = np.minimum(np.searchsorted(seen, hashes), max(len(seen) - 1, 0))
+            repeated = np.zeros(len(chunk), dtype=bool)
+            repeated[present] = seen[positions] == hashes if len(seen) else False
+            if repeated.any():
+                issues.append(_issue(spec.table_name, spec.PK, 'primary_key', keys, repeated))
+            # Merging two sorted runs is linear
+            seen = np.sort(np.concatenate([seen, hashes]), kind='stable')
+        reportIssues(issues)
+        yield chunk
+
+def _keyHashes(keys):
+    # Numbers hash as floats, so a key hashes alike in chunks where missing keys made its column float
+    if pd.api.types.is_numeric_dtype(keys) and not pd.api.types.is_bool_dtype(keys):
+        keys = keys.astype('float64')
+    else:
+        keys = keys.astype(str)
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+def _spilledChunks(chunks):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i, chunk in enumerate(chunks):
+            paths.append(os.path.join(directory, f'{i:06}.pkl'))
+            chunk.to_pickle(paths[-1])
+        for path in paths:
+            yield pd.read_pickle(path)